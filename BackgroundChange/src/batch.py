@@ -0,0 +1,206 @@
+import argparse
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+import compositing
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class BackgroundCache:
+    # resized backgrounds keyed by output size; the first worker to need a size saves it to the shared
+    # directory and every other worker memory-maps that file instead of resizing again
+    def __init__(self, background_path, cache_dir):
+        self.background_path = background_path
+        self.cache_dir = cache_dir
+        self.background = None
+        self.resized = {}
+
+    def get(self, size):
+        resized = self.resized.get(size)
+        if resized is not None:
+            return resized
+        path = os.path.join(self.cache_dir, f"background_{size[0]}x{size[1]}.npy")
+        if os.path.exists(path):
+            resized = np.load(path, mmap_mode="r")
+        else:
+            if self.background is None:
+                self.background = cv2.imread(self.background_path)
+                if self.background is None:
+                    raise IOError(f"Cannot read background {self.background_path}")
+            resized = cv2.resize(self.background, size)
+            # written under a private name and renamed, so no worker ever maps a half-written file
+            temporary_path = f"{path}.{os.getpid()}.npy"
+            np.save(temporary_path, resized)
+            os.replace(temporary_path, path)
+        self.resized[size] = resized
+        return resized
+
+
+class ResultWriter(threading.Thread):
+    # encoded results wait here for the disk; a full queue holds back new work instead of growing
+    def __init__(self, queue_size):
+        super().__init__(daemon=True)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.failures = 0
+
+    def run(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            output_path, data = item
+            # a write that fails is counted and the queue keeps draining, or the run would block on a full queue
+            try:
+                with open(output_path, "wb") as output:
+                    output.write(data)
+            except Exception as e:
+                self.failures += 1
+                print(f"{output_path}: {e}")
+
+    def put(self, output_path, data):
+        self.results.put((output_path, data))
+
+    def close(self):
+        self.results.put(None)
+        self.join()
+
+
+# set up once per worker process by _init_worker
+_worker_background = None
+
+
+def _init_worker(background):
+    global _worker_background
+    _worker_background = background
+
+
+def process_image(path, output_path, threshold_value, feather=compositing.DEFAULT_FEATHER):
+    # whatever goes wrong on one image is reported for it instead of ending the run
+    try:
+        return _process_image(path, output_path, threshold_value, feather)
+    except Exception as e:
+        return path, output_path, None, str(e) or type(e).__name__
+
+
+def _process_image(path, output_path, threshold_value, feather):
+    # decode, composite and encode all happen in the worker, only the encoded bytes travel back
+    image = cv2.imread(path)
+    if image is None:
+        return path, output_path, None, "could not read image"
+    h, w = image.shape[:2]
+    if isinstance(_worker_background, BackgroundCache):
+        background = _worker_background.get((w, h))
+    else:
+        background = _worker_background
+    result = compositing.replace_background(image, background, threshold_value, feather=feather)
+    ok, encoded = cv2.imencode(os.path.splitext(output_path)[1], result)
+    if not ok:
+        return path, output_path, None, "could not encode result"
+    return path, output_path, encoded.tobytes(), None
+
+
+def iter_image_paths(source):
+    for entry in sorted(os.scandir(source), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path
+
+
+def parse_color(text):
+    # "#rrggbb" or "b,g,r"
+    if text.startswith("#"):
+        r, g, b = (int(text[i:i + 2], 16) for i in (1, 3, 5))
+        return b, g, r
+    return tuple(int(value) for value in text.split(","))
+
+
+def run_batch(source, output_dir, background_path=None, color=None, threshold_value=100, workers=None,
+              extension=None, queue_size=16, feather=compositing.DEFAULT_FEATHER):
+    # settings that would fail every image are checked once, before any work starts
+    if extension and not cv2.haveImageWriter("output" + extension):
+        raise ValueError(f"Cannot write {extension} images")
+    if background_path and not cv2.haveImageReader(background_path):
+        raise IOError(f"Cannot read background {background_path}")
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    cache_dir = tempfile.mkdtemp(prefix="bkgchange_")
+    background = BackgroundCache(background_path, cache_dir) if background_path else color
+
+    writer = ResultWriter(queue_size)
+    writer.start()
+    processed = failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(background,)) as executor:
+            in_flight = set()
+
+            def drain(return_when):
+                nonlocal processed, failed, in_flight
+                finished, in_flight = wait(in_flight, return_when=return_when)
+                for future in finished:
+                    path, output_path, data, error = future.result()
+                    processed += 1
+                    if error:
+                        failed += 1
+                        print(f"{path}: {error}")
+                    else:
+                        writer.put(output_path, data)
+
+            for path in iter_image_paths(source):
+                name, ext = os.path.splitext(os.path.basename(path))
+                output_path = os.path.join(output_dir, name + (extension or ext))
+                if len(in_flight) >= max_in_flight:
+                    drain(FIRST_COMPLETED)
+                in_flight.add(executor.submit(process_image, path, output_path, threshold_value, feather))
+            while in_flight:
+                drain(FIRST_COMPLETED)
+    finally:
+        writer.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return processed, failed + writer.failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replace the background of every image in a directory.")
+    parser.add_argument("source", help="directory of input images")
+    parser.add_argument("output", help="directory for the results")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--background", help="background image, resized to each input's size")
+    group.add_argument("--color", type=parse_color, help="background colour as #rrggbb or b,g,r")
+    parser.add_argument("--threshold", type=int, default=100, help="pixels darker than this are the subject")
+    parser.add_argument("--feather", type=int, default=compositing.DEFAULT_FEATHER,
+                        help="soft edge radius in pixels, 0 for a hard mask")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--format", default=None, help="output extension such as .png (default: keep the input's)")
+    parser.add_argument("--queue-size", type=int, default=16, help="encoded results waiting to be written")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    extension = args.format if not args.format or args.format.startswith(".") else "." + args.format
+    start = time.perf_counter()
+    try:
+        processed, failed = run_batch(args.source, args.output, args.background, args.color, args.threshold,
+                                      args.workers, extension, args.queue_size, args.feather)
+    except (ValueError, IOError) as e:
+        print(e)
+        return 1
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"Processed {processed} images ({failed} failed) in {elapsed:.1f}s, {rate:.1f} images/s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import compositing
+from bench_compositing import legacy_composite
+
+DEFAULT_SIZES = [0.3, 2, 12, 48]
+THRESHOLD = 100
+COLOR = (0, 128, 255)
+
+
+def make_scene(megapixels, seed=0):
+    # dark-outlined light subjects with enclosed holes on a light backdrop, one touching the border,
+    # plus a textured background image of the same size
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 2 / 3) ** 0.5)
+    w = h * 3 // 2
+    image = rng.integers(170, 230, (h, w, 3), dtype=np.uint8)
+    thickness = max(2, h // 200)
+    cv2.ellipse(image, (w // 2, h // 2), (w // 5, h // 3), 0, 0, 360, (200, 190, 180), -1)
+    cv2.ellipse(image, (w // 2, h // 2), (w // 5, h // 3), 0, 0, 360, (20, 20, 30), thickness)
+    cv2.circle(image, (w // 2, h // 2), h // 10, (40, 60, 80), -1)
+    cv2.rectangle(image, (0, h * 2 // 3), (w // 6, h), (30, 40, 50), thickness)
+    for _ in range(30):
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        cv2.circle(image, center, int(rng.integers(h // 80, h // 20)), (25, 25, 25), thickness)
+    background = cv2.resize(rng.integers(0, 255, (64, 96, 3), dtype=np.uint8), (w, h),
+                            interpolation=cv2.INTER_LINEAR)
+    return image, background
+
+
+def time_stage(function, warmup, repeat):
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"best_ms": min(times) * 1000, "median_ms": float(np.median(times)) * 1000}
+
+
+def check_agreement(image, background, gray, mask):
+    # faster paths must not change a single pixel of what bkgchange produces
+    failures = []
+    if not np.array_equal(compositing.subject_mask_flood_fill(gray, THRESHOLD), mask):
+        failures.append("flood fill mask differs from the contour mask")
+    if not np.array_equal(compositing.composite(image, background, mask), legacy_composite(image, background, mask)):
+        failures.append("hard-matte composite differs from the bitwise composite (image background)")
+    if not np.array_equal(compositing.composite(image, COLOR, mask), legacy_composite(image, COLOR, mask)):
+        failures.append("hard-matte composite differs from the bitwise composite (colour background)")
+    return failures
+
+
+def run_size(megapixels, warmup, repeat):
+    image, background = make_scene(megapixels)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    mask = compositing.subject_mask(gray, THRESHOLD)
+    alpha = compositing.feather_matte(mask)
+    out = np.empty_like(image)
+
+    stages = {
+        "grayscale": lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),
+        "threshold": lambda: cv2.threshold(gray, THRESHOLD, 255, cv2.THRESH_BINARY_INV),
+        "contours": lambda: compositing.subject_mask(gray, THRESHOLD),
+        "flood_fill": lambda: compositing.subject_mask_flood_fill(gray, THRESHOLD),
+        "masking": lambda: cv2.bitwise_and(image, image, mask=mask),
+        "feather": lambda: compositing.feather_matte(mask),
+        "composite_legacy": lambda: legacy_composite(image, background, mask),
+        "composite_matte": lambda: compositing.composite(image, background, alpha, out),
+        "end_to_end": lambda: compositing.replace_background(image, background, THRESHOLD, out=out),
+    }
+    result = {
+        "megapixels": megapixels,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "subject_fraction": cv2.countNonZero(mask) / mask.size,
+        "binary_fraction": cv2.countNonZero(binary) / binary.size,
+        "stages": {name: time_stage(function, warmup, repeat) for name, function in stages.items()},
+        "failures": check_agreement(image, background, gray, mask),
+    }
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = {entry["megapixels"]: entry for entry in json.load(baseline_file)["results"]}
+    print(f"\nagainst {baseline_path} (best time, lower ratio is faster)")
+    for entry in results:
+        previous = baseline.get(entry["megapixels"])
+        if previous is None:
+            continue
+        for name, timing in entry["stages"].items():
+            if name in previous["stages"]:
+                ratio = timing["best_ms"] / max(previous["stages"][name]["best_ms"], 1e-9)
+                print(f"{entry['megapixels']:>6g} MP {name:<18} {ratio:>6.2f}x")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage timing and pixel-exact checks of the background "
+                                                 "change pipeline on synthetic images.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="image sizes in megapixels")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for megapixels in args.sizes:
+        entry = run_size(megapixels, args.warmup, args.repeat)
+        results.append(entry)
+        print(f"{megapixels:g} MP ({entry['width']}x{entry['height']})")
+        for name, timing in entry["stages"].items():
+            print(f"  {name:<18} {timing['best_ms']:>9.1f} ms best {timing['median_ms']:>9.1f} ms median")
+        for failure in entry["failures"]:
+            print(f"  FAIL: {failure}")
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "opencv_threads": cv2.getNumThreads(),
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 1 if any(entry["failures"] for entry in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
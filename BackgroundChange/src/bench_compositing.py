@@ -0,0 +1,91 @@
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import compositing
+
+
+def legacy_composite(image, background, mask):
+    # the bitwise path bkgchange used before the soft-matte kernel
+    mask_inv = cv2.bitwise_not(mask)
+    foreground = cv2.bitwise_and(image, image, mask=mask)
+    if not isinstance(background, np.ndarray):
+        background = np.full(image.shape, background, dtype=np.uint8)
+    background = cv2.bitwise_and(background, background, mask=mask_inv)
+    return cv2.add(foreground, background)
+
+
+def make_images(megapixels, seed=0):
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 2 / 3) ** 0.5)
+    w = h * 3 // 2
+    image = rng.integers(170, 230, (h, w, 3), dtype=np.uint8)
+    cv2.ellipse(image, (w // 2, h // 2), (w // 4, h // 3), 0, 0, 360, (40, 60, 80), -1)
+    for _ in range(20):
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        cv2.circle(image, center, int(rng.integers(h // 60, h // 15)), (30, 30, 30), -1)
+    background = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    return image, background
+
+
+def make_textured_images(megapixels, seed=0):
+    # a grainy scene whose matte breaks up into thousands of specks, so hardly a column of a strip is
+    # fully opaque or fully clear
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 2 / 3) ** 0.5)
+    w = h * 3 // 2
+    texture = cv2.GaussianBlur(rng.integers(0, 256, (h, w), dtype=np.uint8), (0, 0), 3)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX)
+    image = cv2.merge([texture, texture, texture])
+    background = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    return image, background
+
+
+def measure(function, repeat):
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soft-matte compositing against the bitwise_and/add path.")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[2, 12, 20])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--feather", type=int, default=compositing.DEFAULT_FEATHER)
+    args = parser.parse_args()
+
+    print(f"{'MP':>5} {'scene':<9} {'background':<10} {'path':<14} {'best ms':>9} {'peak MB':>9}")
+    for megapixels in args.megapixels:
+        scenes = (("smooth", make_images(megapixels), 100), ("textured", make_textured_images(megapixels), 120))
+        for scene, (image, background_image), threshold in scenes:
+            mask = compositing.subject_mask(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), threshold)
+            alpha = compositing.feather_matte(mask, args.feather)
+            out = np.empty_like(image)
+            # a hard alpha must reproduce the old output exactly
+            assert np.array_equal(compositing.composite(image, background_image, mask, out),
+                                  legacy_composite(image, background_image, mask))
+            for name, background in (("image", background_image), ("color", (0, 128, 255))):
+                cases = (
+                    ("legacy", lambda: legacy_composite(image, background, mask)),
+                    ("matte hard", lambda: compositing.composite(image, background, mask, out)),
+                    ("matte soft", lambda: compositing.composite(image, background, alpha, out)),
+                )
+                for path, function in cases:
+                    best, peak = measure(function, args.repeat)
+                    print(f"{megapixels:>5g} {scene:<9} {name:<10} {path:<14} {best * 1000:>9.1f} "
+                          f"{peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
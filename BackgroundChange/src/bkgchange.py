@@ -1,9 +1,20 @@
+from collections import OrderedDict
+
 import cv2
 import numpy as np
 from PyQt6 import QtCore, QtGui, QtWidgets
 from PyQt6.QtWidgets import QFileDialog, QColorDialog
 from PyQt6.QtGui import QPixmap, QImage, QIntValidator
 
+import compositing
+
+# a slider drag re-composites at most once per interval, about 60 times per second
+PREVIEW_INTERVAL_MS = 16
+# preview-sized subject masks kept per threshold value, so scrubbing back and forth is a lookup
+MASK_CACHE_SIZE = 64
+# previews per row in the comparison grid
+COMPARE_COLUMNS = 3
+
 
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
@@ -89,6 +100,15 @@ class Ui_MainWindow(object):
         self.threshLineEdit.setStyleSheet("background-color: white;")
         self.threshLineEdit.setValidator(QIntValidator(0, 255))
 
+        self.threshStatsLabel = QtWidgets.QLabel(parent=self.centralwidget)
+        self.threshStatsLabel.setGeometry(QtCore.QRect(400, 62, 250, 16))
+        self.threshStatsLabel.setObjectName("threshStatsLabel")
+
+        self.suggestButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.suggestButton.setGeometry(QtCore.QRect(655, 60, 50, 20))
+        self.suggestButton.setObjectName("suggestButton")
+        self.suggestButton.setEnabled(False)
+
         self.applyButton = QtWidgets.QPushButton(parent=self.centralwidget)
         self.applyButton.setGeometry(QtCore.QRect(610, 400, 80, 24))
         self.applyButton.setObjectName("applyButton")
@@ -100,6 +120,41 @@ class Ui_MainWindow(object):
         )
         self.applyButton.setEnabled(False)
 
+        self.exportButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.exportButton.setGeometry(QtCore.QRect(520, 400, 80, 24))
+        self.exportButton.setObjectName("exportButton")
+        self.exportButton.setStyleSheet(
+            "QPushButton:disabled { background-color: #a8a8a8; color: #3b3b3b; border: 2px solid #5e5e5e; border-radius: 10px; } "
+            "QPushButton:enabled { background-color: #27ae60; color: white; border: 2px solid #1e8449; border-radius: 10px; } "
+            "QPushButton:hover { background-color: #1e8449; } "
+            "QPushButton:pressed { background-color: #f39c12; }"
+        )
+        self.exportButton.setEnabled(False)
+
+        self.liveCheckBox = QtWidgets.QCheckBox(parent=self.centralwidget)
+        self.liveCheckBox.setGeometry(QtCore.QRect(420, 400, 91, 24))
+        self.liveCheckBox.setObjectName("liveCheckBox")
+        self.liveCheckBox.setChecked(True)
+
+        self.compareAddButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.compareAddButton.setGeometry(QtCore.QRect(40, 400, 110, 24))
+        self.compareAddButton.setObjectName("compareAddButton")
+        self.compareAddButton.setEnabled(False)
+        self.compareButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.compareButton.setGeometry(QtCore.QRect(160, 400, 80, 24))
+        self.compareButton.setObjectName("compareButton")
+        self.compareButton.setEnabled(False)
+        self.compareClearButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.compareClearButton.setGeometry(QtCore.QRect(250, 400, 60, 24))
+        self.compareClearButton.setObjectName("compareClearButton")
+        self.compareClearButton.setEnabled(False)
+
+        # slider moves only start the timer, so a fast drag is coalesced into one preview per tick
+        self.previewTimer = QtCore.QTimer()
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(PREVIEW_INTERVAL_MS)
+        self.previewTimer.timeout.connect(self.apply_background_change)
+
         # connecting signals to slots
         self.inputImgButton.clicked.connect(lambda: self.load_image('input'))
         self.bkgImgButton.clicked.connect(lambda: self.load_image('background'))
@@ -107,9 +162,37 @@ class Ui_MainWindow(object):
         self.threshSlider.valueChanged.connect(self.update_threshold_line_edit)
         self.threshLineEdit.textChanged.connect(self.update_slider_from_line_edit)
         self.applyButton.clicked.connect(self.apply_background_change)
-
+        self.exportButton.clicked.connect(self.export_result)
+        self.threshSlider.valueChanged.connect(self.schedule_preview)
+        self.liveCheckBox.toggled.connect(self.schedule_preview)
+        self.threshSlider.valueChanged.connect(self.update_threshold_stats)
+        self.suggestButton.clicked.connect(self.use_suggested_threshold)
+        self.compareAddButton.clicked.connect(self.add_compare_background)
+        self.compareButton.clicked.connect(self.show_compare)
+        self.compareClearButton.clicked.connect(self.clear_compare)
+
+        # files are decoded at full resolution only on export, everything on screen comes from reduced decodes
+        self.input_path = None
+        self.input_width = None
+        self.background_path = None
         self.background_image = None
         self.selected_color = None
+        # downsampled copies the preview works on, refreshed only when an image is loaded
+        self.preview_image = None
+        self.preview_gray = None
+        self.preview_background = None
+        self.preview_result = None
+        # gray-level histogram of the reduced input, every per-threshold number is read from it
+        self.histogram = None
+        self.cumulative_histogram = None
+        self.otsu_value = None
+        self.triangle_value = None
+        self.mask_cache = OrderedDict()
+        # candidate backgrounds (reduced RGB images or RGB colours) and their preview-sized (K, H, W, 3) stack
+        self.compare_sources = []
+        self.compare_stack = None
+        self.compare_result = None
+        self.compareWindow = None
 
         MainWindow.setCentralWidget(self.centralwidget)
 
@@ -128,6 +211,12 @@ class Ui_MainWindow(object):
         self.threshLineEdit.setText(_translate("MainWindow", "100"))
         self.resultLabel.setText(_translate("MainWindow", "Result"))
         self.applyButton.setText(_translate("MainWindow", "Apply"))
+        self.exportButton.setText(_translate("MainWindow", "Export"))
+        self.liveCheckBox.setText(_translate("MainWindow", "Live preview"))
+        self.suggestButton.setText(_translate("MainWindow", "Otsu"))
+        self.compareAddButton.setText(_translate("MainWindow", "Add to Compare"))
+        self.compareButton.setText(_translate("MainWindow", "Compare"))
+        self.compareClearButton.setText(_translate("MainWindow", "Clear"))
 
     def load_image(self, img_type):
         file_dialog = QFileDialog()
@@ -137,7 +226,10 @@ class Ui_MainWindow(object):
                                                    "Images (*.png *.jpeg *.jpg *.bmp)")
 
         if file_path:
-            image = cv2.imread(file_path)
+            label = self.inputImgDisplayLabel if img_type == 'input' else self.bkgImgDisplayLabel
+            image, factor = compositing.read_reduced(file_path, (label.width(), label.height()), fit=True)
+            if image is None:
+                return
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             h, w, channel = image.shape
             bytes_per_line = 3 * w
@@ -147,31 +239,52 @@ class Ui_MainWindow(object):
             if img_type == 'input':
                 self.inputImgDisplayLabel.setPixmap(pixmap.scaled(self.inputImgDisplayLabel.size(),
                                                                   QtCore.Qt.AspectRatioMode.KeepAspectRatio))
-                self.input_image = image
+                self.input_path = file_path
+                self.input_width = image.shape[1] * factor
+                self.preview_image = self.downscale_to_label(image, self.resultImgDisplayLabel)
+                self.preview_gray = cv2.cvtColor(self.preview_image, cv2.COLOR_BGR2GRAY)
+                self.histogram, self.cumulative_histogram = compositing.gray_histogram(
+                    cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+                self.otsu_value = compositing.otsu_threshold(self.histogram)
+                self.triangle_value = compositing.triangle_threshold(self.histogram)
+                self.mask_cache.clear()
+                self.compare_stack = None
+                self.suggestButton.setEnabled(True)
+                self.update_threshold_stats(self.threshSlider.value())
             elif img_type == 'background':
                 self.bkgImgDisplayLabel.setPixmap(pixmap.scaled(self.bkgImgDisplayLabel.size(),
                                                                 QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+                self.background_path = file_path
                 self.background_image = image
                 self.selected_color = None
 
+            self.update_preview_background()
             self.update_apply_button_state()
+            self.schedule_preview()
 
     def choose_background_color(self):
         color_dialog = QColorDialog()
         color = color_dialog.getColor()
         if color.isValid():
             self.selected_color = color
+            self.background_path = None
             self.background_image = None
             color_pixmap = QPixmap(250, 250)
             color_pixmap.fill(color)
             self.bkgImgDisplayLabel.setPixmap(color_pixmap)
+            self.update_preview_background()
             self.update_apply_button_state()
+            self.schedule_preview()
 
     def update_apply_button_state(self):
-        if hasattr(self, 'input_image') and (self.background_image is not None or self.selected_color is not None):
+        if self.input_path is not None and (self.background_image is not None or self.selected_color is not None):
             self.applyButton.setEnabled(True)
+            self.exportButton.setEnabled(True)
+            self.compareAddButton.setEnabled(True)
         else:
             self.applyButton.setEnabled(False)
+            self.exportButton.setEnabled(False)
+            self.compareAddButton.setEnabled(False)
 
     def update_threshold_line_edit(self, value):
         self.threshLineEdit.setText(str(value))
@@ -180,56 +293,153 @@ class Ui_MainWindow(object):
         value = int(self.threshLineEdit.text()) if self.threshLineEdit.text() else 0
         self.threshSlider.setValue(value)
 
-    def apply_background_change(self):
-        if hasattr(self, 'input_image') and (self.background_image is not None or self.selected_color is not None):
-            # convert input image to grayscale and apply thresholding
-            gray_image = cv2.cvtColor(self.input_image, cv2.COLOR_BGR2GRAY)
-
-            # retrieve threshold value from the line edit
-            threshold_value = int(self.threshLineEdit.text()) if self.threshLineEdit.text() else 0
-
-            _, binary_mask = cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY_INV)
-
-            # find contours to isolate the subject
-            contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            # create a mask that covers the subject
-            mask = np.zeros_like(gray_image)
-            cv2.drawContours(mask, contours, -1, (255), thickness=cv2.FILLED)
-
-            # create an inverse mask to keep the subject content intact
-            mask_inv = cv2.bitwise_not(mask)
+    def downscale_to_label(self, image, label):
+        h, w = image.shape[:2]
+        scale = min(label.width() / w, label.height() / h, 1.0)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def update_preview_background(self):
+        # the background is resized once per loaded image, not on every slider move
+        if self.preview_image is not None and self.background_image is not None:
+            h, w = self.preview_image.shape[:2]
+            self.preview_background = cv2.resize(self.background_image, (w, h), interpolation=cv2.INTER_AREA)
+        else:
+            self.preview_background = None
 
-            # extracting the subject
-            foreground = cv2.bitwise_and(self.input_image, self.input_image, mask=mask)
+    def schedule_preview(self):
+        if self.liveCheckBox.isChecked() and self.applyButton.isEnabled() and not self.previewTimer.isActive():
+            self.previewTimer.start()
 
-            # check if background is an image or color
-            h, w = mask.shape[:2]
-            if self.background_image is not None:
-                background_resized = cv2.resize(self.background_image, (w, h))
-                background = cv2.bitwise_and(background_resized, background_resized, mask=mask_inv)
-                requires_rgb_conversion = False
-                self.selected_color = None
-            elif self.selected_color is not None:
-                b, g, r = self.selected_color.blue(), self.selected_color.green(), self.selected_color.red()
-                color_img = np.full((h, w, 3), (b, g, r), dtype=np.uint8)
-                background = cv2.bitwise_and(color_img, color_img, mask=mask_inv)
-                requires_rgb_conversion = True
-                self.background_image = None
-            else:
-                QtWidgets.QMessageBox.warning(self.centralwidget, "Warning", "No background selected.")
-                return
+    def threshold_value(self):
+        return int(self.threshLineEdit.text()) if self.threshLineEdit.text() else 0
 
-            # combine the subject with the background
-            result = cv2.add(foreground, background)
+    def selected_color_rgb(self):
+        # images are kept in RGB order once loaded
+        return self.selected_color.red(), self.selected_color.green(), self.selected_color.blue()
 
-            # convert result for display in QLabel
-            result = cv2.cvtColor(result, cv2.COLOR_BGR2RGB) if requires_rgb_conversion else result
-            h, w, channel = result.shape
-            bytes_per_line = 3 * w
-            q_image = QtGui.QImage(result.data, w, h, bytes_per_line, QtGui.QImage.Format.Format_RGB888)
-            self.resultImgDisplayLabel.setPixmap(QtGui.QPixmap.fromImage(q_image).scaled(191, 191,
-                                                QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+    def apply_background_change(self):
+        # works on the cached preview copies, the full-resolution result is only made on export
+        if self.preview_image is None or (self.background_image is None and self.selected_color is None):
+            return
+        if self.background_image is not None:
+            background = self.preview_background
+        else:
+            background = self.selected_color_rgb()
+        if self.preview_result is None or self.preview_result.shape != self.preview_image.shape:
+            self.preview_result = np.empty_like(self.preview_image)
+        alpha = self.preview_alpha()
+        result = compositing.composite(self.preview_image, background, alpha, self.preview_result)
+        if self.compareWindow is not None and self.compareWindow.isVisible():
+            self.update_compare(alpha)
+
+        # the preview already has the label's size, so it is shown without scaling
+        h, w, channel = result.shape
+        bytes_per_line = 3 * w
+        q_image = QtGui.QImage(result.data, w, h, bytes_per_line, QtGui.QImage.Format.Format_RGB888)
+        self.resultImgDisplayLabel.setPixmap(QtGui.QPixmap.fromImage(q_image))
+
+    def preview_alpha(self):
+        # the soft edge shrinks with the preview so it looks like the exported result
+        feather = round(compositing.DEFAULT_FEATHER * self.preview_image.shape[1] / self.input_width)
+        return compositing.feather_matte(self.preview_mask(self.threshold_value()), feather)
+
+    def preview_mask(self, threshold_value):
+        mask = self.mask_cache.get(threshold_value)
+        if mask is None:
+            mask = compositing.subject_mask(self.preview_gray, threshold_value)
+            self.mask_cache[threshold_value] = mask
+            if len(self.mask_cache) > MASK_CACHE_SIZE:
+                self.mask_cache.popitem(last=False)
+        else:
+            self.mask_cache.move_to_end(threshold_value)
+        return mask
+
+    def update_threshold_stats(self, value):
+        # a lookup in the cumulative histogram, the image itself is not touched
+        if self.cumulative_histogram is None:
+            return
+        fraction = self.cumulative_histogram[value] / self.cumulative_histogram[-1]
+        self.threshStatsLabel.setText(f"Foreground: {fraction:.1%}  Otsu: {self.otsu_value}  "
+                                      f"Triangle: {self.triangle_value}")
+
+    def use_suggested_threshold(self):
+        if self.otsu_value is not None:
+            self.threshSlider.setValue(self.otsu_value)
+
+    def add_compare_background(self):
+        if self.background_image is not None:
+            self.compare_sources.append(self.background_image)
+        elif self.selected_color is not None:
+            self.compare_sources.append(self.selected_color_rgb())
+        else:
+            return
+        self.compare_stack = None
+        self.compareButton.setEnabled(True)
+        self.compareClearButton.setEnabled(True)
+        if self.compareWindow is not None and self.compareWindow.isVisible():
+            self.update_compare()
+
+    def clear_compare(self):
+        self.compare_sources = []
+        self.compare_stack = None
+        self.compare_result = None
+        self.compareButton.setEnabled(False)
+        self.compareClearButton.setEnabled(False)
+        if self.compareWindow is not None:
+            self.compareWindow.hide()
+
+    def show_compare(self):
+        if self.compareWindow is None:
+            self.compareWindow = QtWidgets.QLabel()
+            self.compareWindow.setWindowTitle("Compare backgrounds")
+        self.update_compare()
+        self.compareWindow.show()
+        self.compareWindow.raise_()
+
+    def compare_backgrounds(self):
+        # every candidate resized to the preview once, until the input or the candidates change
+        h, w = self.preview_image.shape[:2]
+        if self.compare_stack is None or self.compare_stack.shape[1:3] != (h, w):
+            self.compare_stack = np.empty((len(self.compare_sources), h, w, 3), dtype=np.uint8)
+            for background, source in zip(self.compare_stack, self.compare_sources):
+                if isinstance(source, np.ndarray):
+                    cv2.resize(source, (w, h), dst=background, interpolation=cv2.INTER_AREA)
+                else:
+                    background[:] = source
+            self.compare_result = np.empty_like(self.compare_stack)
+        return self.compare_stack
+
+    def update_compare(self, alpha=None):
+        # one matte for all candidates, blended against the whole stack at once
+        if self.preview_image is None or not self.compare_sources:
+            return
+        if alpha is None:
+            alpha = self.preview_alpha()
+        backgrounds = self.compare_backgrounds()
+        results = compositing.composite_stack(self.preview_image, backgrounds, alpha, self.compare_result)
+        sheet = compositing.grid(results, min(COMPARE_COLUMNS, len(results)))
+        h, w, channel = sheet.shape
+        q_image = QtGui.QImage(sheet.data, w, h, 3 * w, QtGui.QImage.Format.Format_RGB888)
+        self.compareWindow.setPixmap(QtGui.QPixmap.fromImage(q_image))
+        self.compareWindow.resize(w, h)
+
+    def export_result(self):
+        if self.input_path is None or (self.background_path is None and self.selected_color is None):
+            return
+        file_path, _ = QFileDialog.getSaveFileName(None, "Export Result", "", "Images (*.png *.jpg *.bmp)")
+        if not file_path:
+            return
+        # the full-size image and its mask are the only full-size arrays, the result is made and written
+        # in strips; the input stays in BGR and RGB2GRAY gives it the gray the RGB preview gets from BGR2GRAY
+        image = cv2.imread(self.input_path)
+        h, w = image.shape[:2]
+        mask = compositing.subject_mask(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), self.threshold_value())
+        if self.background_path is not None:
+            background, _ = compositing.read_reduced(self.background_path, (w, h))
+        else:
+            background = self.selected_color_rgb()[::-1]
+        compositing.write_strips(file_path, (w, h), compositing.composite_strips(image, background, mask))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,282 @@
+import os
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+# feather radius in pixels of the soft edge around the subject, 0 keeps the hard mask
+DEFAULT_FEATHER = 2
+# rows composited at a time, small enough for the 16-bit temporaries to stay in cache
+BLEND_STRIP_ROWS = 32
+# a strip whose matte splits into more column runs than this is blended whole, one multiply beats many small copies
+MAX_STRIP_RUNS = 8
+# rows of the full-resolution image exported at a time
+EXPORT_STRIP_ROWS = 256
+# zlib level of the streamed PNG export, cv2 writes PNG at 1 by default
+PNG_COMPRESSION = 3
+# JPEG decodes straight to these fractions of its size, other formats are decoded and then shrunk
+REDUCED_DECODES = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                   (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR))
+
+
+def subject_mask(gray_image, threshold_value):
+    # pixels darker than the threshold are the subject, holes inside its outline are filled
+    _, binary_mask = cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY_INV)
+
+    # find contours to isolate the subject
+    contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # create a mask that covers the subject
+    mask = np.zeros_like(gray_image)
+    cv2.drawContours(mask, contours, -1, (255), thickness=cv2.FILLED)
+    return mask
+
+
+def subject_mask_flood_fill(gray_image, threshold_value):
+    # the same mask as subject_mask: flood the background in from a one pixel frame around the image,
+    # whatever it does not reach is the subject or enclosed by it
+    _, binary_mask = cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY_INV)
+    h, w = binary_mask.shape
+    padded = cv2.copyMakeBorder(binary_mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    cv2.floodFill(padded, np.zeros((h + 4, w + 4), dtype=np.uint8), (0, 0), 255)
+    return cv2.bitwise_or(binary_mask, cv2.bitwise_not(padded[1:-1, 1:-1]))
+
+
+def gray_histogram(gray_image):
+    # counts per gray level and their running sum: cumulative[t] pixels fall under THRESH_BINARY_INV at t
+    histogram = np.bincount(gray_image.ravel(), minlength=256)
+    return histogram, np.cumsum(histogram)
+
+
+def otsu_threshold(histogram):
+    # cv2's THRESH_OTSU search run on a histogram instead of the image
+    probabilities = histogram / histogram.sum()
+    mean = float((np.arange(256) * probabilities).sum())
+    q1 = mean1 = 0.0
+    best_sigma, best_value = 0.0, 0
+    epsilon = float(np.finfo(np.float32).eps)
+    for value, p in enumerate(probabilities.tolist()):
+        mean1 *= q1
+        q1 += p
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+        mean1 = (mean1 + value * p) / q1
+        mean2 = (mean - q1 * mean1) / q2
+        sigma = q1 * q2 * (mean1 - mean2) ** 2
+        if sigma > best_sigma:
+            best_sigma, best_value = sigma, value
+    return best_value
+
+
+def triangle_threshold(histogram):
+    # cv2's THRESH_TRIANGLE search run on a histogram, suits a small subject on a large even backdrop
+    counts = histogram.tolist()
+    left = next((i for i in range(256) if counts[i] > 0), 0)
+    left = max(left - 1, 0)
+    right = next((i for i in range(255, 0, -1) if counts[i] > 0), 0)
+    right = min(right + 1, 255)
+    peak = counts.index(max(counts))
+    # the line is drawn from the peak to the end of the longer tail
+    flipped = peak - left < right - peak
+    if flipped:
+        counts.reverse()
+        left, peak = 255 - right, 255 - peak
+    best_distance, value = 0.0, left
+    for i in range(left + 1, peak + 1):
+        distance = float(np.float32(counts[peak] * i + (left - peak) * counts[i]))
+        if distance > best_distance:
+            best_distance, value = distance, i
+    value -= 1
+    return 255 - value if flipped else value
+
+
+def feather_matte(mask, radius=DEFAULT_FEATHER, method="blur"):
+    # 8-bit alpha from the hard subject mask, 255 inside and falling to 0 across the edge
+    if radius <= 0:
+        return mask
+    if method == "distance":
+        # signed distance to the outline, mapped linearly over radius pixels on either side
+        inside = cv2.distanceTransform(mask, cv2.DIST_L2, 3)
+        outside = cv2.distanceTransform(cv2.bitwise_not(mask), cv2.DIST_L2, 3)
+        cv2.subtract(inside, outside, dst=inside)
+        inside *= 127.5 / radius
+        inside += 128
+        np.clip(inside, 0, 255, out=inside)
+        return inside.astype(np.uint8)
+    return cv2.GaussianBlur(mask, (2 * radius + 1, 2 * radius + 1), 0)
+
+
+def composite(foreground, background, alpha, out=None):
+    # out = round((fg * a + bg * (255 - a)) / 255), written strip by strip into a preallocated output;
+    # background is an image of the same size or a colour in the image's channel order
+    h, w = alpha.shape
+    if out is None:
+        out = np.empty_like(foreground)
+    color_rows = None
+    if not isinstance(background, np.ndarray):
+        # one strip of colour stands in for a full colour image
+        color_rows = np.empty((BLEND_STRIP_ROWS, w, 3), dtype=np.uint8)
+        color_rows[:] = background
+    elif background.shape != foreground.shape:
+        raise ValueError(f"Background is {background.shape}, expected {foreground.shape}")
+
+    for y in range(0, h, BLEND_STRIP_ROWS):
+        rows = slice(y, y + BLEND_STRIP_ROWS)
+        strip = alpha[rows]
+        background_rows = background[rows] if color_rows is None else color_rows[:len(strip)]
+        # columns of the strip are fully opaque (2), fully transparent (0) or partly covered (1);
+        # only the partly covered runs pay for the multiply, the rest are plain copies
+        kind = np.where(strip.min(axis=0) == 255, 2, np.where(strip.max(axis=0) == 0, 0, 1))
+        ends = np.flatnonzero(kind[1:] != kind[:-1]).tolist() + [w - 1]
+        if len(ends) > MAX_STRIP_RUNS:
+            _blend(foreground[rows], background_rows, strip, out[rows])
+            continue
+        x0 = 0
+        for x1 in ends:
+            columns = slice(x0, x1 + 1)
+            if kind[x0] == 2:
+                out[rows, columns] = foreground[rows, columns]
+            elif kind[x0] == 0:
+                out[rows, columns] = background_rows[:, columns]
+            else:
+                _blend(foreground[rows, columns], background_rows[:, columns], strip[:, columns], out[rows, columns])
+            x0 = x1 + 1
+    return out
+
+
+def composite_stack(foreground, backgrounds, alpha, out=None):
+    # one foreground and matte over K backgrounds stacked as (K, H, W, 3) in a single batched blend;
+    # the foreground term is shared, so every extra background costs one multiply-add. Rounds as composite does
+    a = alpha[:, :, None].astype(np.uint16)
+    shared = foreground * a
+    shared += 127
+    total = backgrounds * (255 - a)
+    total += shared
+    if out is None:
+        out = np.empty(backgrounds.shape, dtype=np.uint8)
+    np.floor_divide(total, 255, out=out, casting="unsafe")
+    return out
+
+
+def grid(stack, columns):
+    # (K, H, W, 3) images laid out left to right, top to bottom, empty cells stay black
+    count, h, w = stack.shape[:3]
+    rows = -(-count // columns)
+    cells = np.zeros((rows * columns, h, w, 3), dtype=np.uint8)
+    cells[:count] = stack
+    return np.ascontiguousarray(cells.reshape(rows, columns, h, w, 3).transpose(0, 2, 1, 3, 4)
+                                .reshape(rows * h, columns * w, 3))
+
+
+def _blend(foreground, background, alpha, out):
+    alpha3 = cv2.merge([alpha, alpha, alpha])
+    # numpy widens 8-bit products to 16 bits in one pass, cv2.multiply takes twice as long to do the same
+    total = np.multiply(foreground, alpha3, dtype=np.uint16)
+    total += np.multiply(background, cv2.bitwise_not(alpha3), dtype=np.uint16)
+    # the integer sum over 255 is never exactly halfway, so the scaled conversion rounds it exactly
+    cv2.convertScaleAbs(total, dst=out, alpha=1 / 255.0)
+
+
+def replace_background(image, background, threshold_value, gray_image=None, feather=DEFAULT_FEATHER, out=None):
+    # background is an image of the same size or a colour tuple in the image's channel order
+    if gray_image is None:
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    alpha = feather_matte(subject_mask(gray_image, threshold_value), feather)
+    return composite(image, background, alpha, out)
+
+
+def read_reduced(path, size, fit=False):
+    # decode at the smallest 1/8, 1/4, 1/2 or full scale that still covers size (w, h), with fit it is enough
+    # for one side to reach it since the image is scaled down into size keeping its aspect;
+    # returns the image and the reduction factor, or (None, 1) when the file cannot be read
+    def covers(w, h):
+        wide, tall = w >= size[0], h >= size[1]
+        return wide or tall if fit else wide and tall
+
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        return None, 1
+    if covers(image.shape[1], image.shape[0]):
+        return image, 8
+    # the 1/8 decode tells the full size to within 7 pixels, JPEG rounds it up and other formats down, so the
+    # scale is picked from the smallest size the file can have and only one more decode is made
+    w, h = 8 * image.shape[1] - 7, 8 * image.shape[0] - 7
+    for factor, flag in REDUCED_DECODES[1:]:
+        if factor == 1 or covers(w // factor, h // factor):
+            image = cv2.imread(path, flag)
+            return (image, factor) if image is not None else (None, 1)
+
+
+def resize_rows(image, size, y, rows, out=None):
+    # rows y to y + rows of cv2.resize(image, size), sampled bilinearly without making the full-size resize
+    w, h = size
+    if image.shape[1] == w and image.shape[0] == h:
+        return image[y:y + rows]
+    sx, sy = image.shape[1] / w, image.shape[0] / h
+    matrix = np.float32([[sx, 0, 0.5 * sx - 0.5], [0, sy, sy * (y + 0.5) - 0.5]])
+    return cv2.warpAffine(image, matrix, (w, rows), dst=out, flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def composite_strips(image, background, mask, feather=DEFAULT_FEATHER, strip_rows=EXPORT_STRIP_ROWS):
+    # the composited image as bands of rows, all written into the same buffer; each band's matte is blurred
+    # with feather rows of the mask around it, so the bands come out as the whole image would.
+    # background is a colour or an image of any size, resized to the mask's size one band at a time
+    h, w = mask.shape
+    out = np.empty((strip_rows, w, 3), dtype=np.uint8)
+    background_rows = np.empty_like(out) if isinstance(background, np.ndarray) else None
+    for y in range(0, h, strip_rows):
+        rows = min(strip_rows, h - y)
+        top, bottom = max(0, y - feather), min(h, y + rows + feather)
+        alpha = feather_matte(mask[top:bottom], feather)[y - top:y - top + rows]
+        if background_rows is None:
+            background_strip = background
+        else:
+            background_strip = resize_rows(background, (w, h), y, rows, background_rows[:rows])
+        yield composite(image[y:y + rows], background_strip, alpha, out[:rows])
+
+
+def write_strips(path, size, strips):
+    # PNG is compressed and written band by band; other formats go through one full-size buffer for cv2
+    w, h = size
+    if os.path.splitext(path)[1].lower() == ".png":
+        _write_png(path, w, h, strips)
+        return True
+    result = np.empty((h, w, 3), dtype=np.uint8)
+    y = 0
+    for strip in strips:
+        result[y:y + len(strip)] = strip
+        y += len(strip)
+    return cv2.imwrite(path, result)
+
+
+def _write_png(path, w, h, strips):
+    # 8-bit RGB, every scanline with the "up" filter: the difference to the row above compresses well on photos
+    compressor = zlib.compressobj(PNG_COMPRESSION)
+    previous = np.zeros(w * 3, dtype=np.uint8)
+    scanlines = None
+    with open(path, "wb") as output:
+        output.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(output, b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+        for strip in strips:
+            rows = len(strip)
+            if scanlines is None or len(scanlines) < rows:
+                scanlines = np.empty((rows, w * 3 + 1), dtype=np.uint8)
+                scanlines[:, 0] = 2
+            pixels = cv2.cvtColor(strip, cv2.COLOR_BGR2RGB).reshape(rows, w * 3)
+            np.subtract(pixels[1:], pixels[:-1], out=scanlines[1:rows, 1:])
+            np.subtract(pixels[0], previous, out=scanlines[0, 1:])
+            previous = pixels[-1].copy()
+            data = compressor.compress(scanlines[:rows])
+            if data:
+                _png_chunk(output, b"IDAT", data)
+        _png_chunk(output, b"IDAT", compressor.flush())
+        _png_chunk(output, b"IEND", b"")
+
+
+def _png_chunk(output, kind, data):
+    output.write(struct.pack(">I", len(data)) + kind)
+    output.write(data)
+    output.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
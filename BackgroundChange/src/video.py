@@ -0,0 +1,286 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import compositing
+from batch import parse_color
+
+SUBTRACTORS = {
+    "mog2": lambda: cv2.createBackgroundSubtractorMOG2(detectShadows=True),
+    "knn": lambda: cv2.createBackgroundSubtractorKNN(detectShadows=True),
+}
+FOURCC = {".mp4": "mp4v", ".avi": "MJPG", ".mkv": "XVID", ".mov": "mp4v"}
+# resized frames of a background clip kept for looping, beyond this the clip is decoded again every loop
+BACKGROUND_CACHE_MB = 512
+
+
+class FrameReader(threading.Thread):
+    # decodes ahead of the processing loop; the bounded queue holds decoding back when processing is slower
+    def __init__(self, path, queue_size=8):
+        super().__init__(daemon=True)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                     int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.frames_read = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                break
+            self.frames_read += 1
+            self._put(frame)
+        self.capture.release()
+        self._put(None)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def stop(self):
+        self.stopped.set()
+
+
+class FrameWriter(threading.Thread):
+    # encodes on its own thread; frames come from a ring of output buffers that is one longer than
+    # the queue plus the frame being encoded, so the processing loop never overwrites a queued frame
+    def __init__(self, path, fps, size, queue_size=8):
+        super().__init__(daemon=True)
+        fourcc = FOURCC.get(os.path.splitext(path)[1].lower(), "mp4v")
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if not self.writer.isOpened():
+            raise IOError(f"Cannot write video {path}")
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.buffers = [np.empty((size[1], size[0], 3), dtype=np.uint8) for _ in range(queue_size + 2)]
+        self.next_buffer = 0
+        self.frames_written = 0
+
+    def buffer(self):
+        out = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        return out
+
+    def run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            self.writer.write(frame)
+            self.frames_written += 1
+        self.writer.release()
+
+    def put(self, frame):
+        self.frames.put(frame)
+
+    def close(self):
+        self.frames.put(None)
+        self.join()
+
+
+class StaticBackground:
+    # an image resized once to the output size, or a colour
+    def __init__(self, background, size):
+        if isinstance(background, np.ndarray):
+            background = cv2.resize(background, size, interpolation=cv2.INTER_AREA)
+        self.background = background
+
+    def next(self):
+        return self.background
+
+    def close(self):
+        pass
+
+
+class VideoBackground:
+    # a background clip looped under the input; every frame is resized to the output size once,
+    # a clip that fits in BACKGROUND_CACHE_MB plays its later loops from the resized copies
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open background video {path}")
+        frame_bytes = size[0] * size[1] * 3
+        self.max_cached = max(1, BACKGROUND_CACHE_MB * 2 ** 20 // frame_bytes)
+        self.cached = []
+        self.caching = True
+        self.complete = False
+        self.position = 0
+        self.buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+    def next(self):
+        if self.complete:
+            frame = self.cached[self.position % len(self.cached)]
+            self.position += 1
+            return frame
+        ok, frame = self.capture.read()
+        if not ok:
+            if self.caching and self.cached:
+                self.complete = True
+                self.capture.release()
+                return self.next()
+            self.capture.release()
+            self.capture = cv2.VideoCapture(self.path)
+            ok, frame = self.capture.read()
+            if not ok:
+                raise IOError(f"Cannot read background video {self.path}")
+        if self.caching:
+            if len(self.cached) < self.max_cached:
+                self.cached.append(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA))
+                return self.cached[-1]
+            # too long to keep, later loops decode it again
+            self.caching = False
+            self.cached = []
+        return cv2.resize(frame, self.size, dst=self.buffer, interpolation=cv2.INTER_AREA)
+
+    def close(self):
+        if not self.complete:
+            self.capture.release()
+
+
+class MatteModel:
+    # subject matte from a learned background model instead of a per-frame threshold: the subtractor runs on a
+    # downscaled frame, shadows count as background, and the mask is averaged over time so edges do not flicker
+    def __init__(self, size, method="mog2", scale=0.5, smoothing=0.5, feather=compositing.DEFAULT_FEATHER,
+                 learning_rate=-1.0):
+        self.size = size
+        self.subtractor = SUBTRACTORS[method]()
+        self.small_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        # weight of the newest mask in the running average, 1 turns the smoothing off
+        self.smoothing = smoothing
+        self.feather = feather
+        self.learning_rate = learning_rate
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        self.small = np.empty((self.small_size[1], self.small_size[0], 3), dtype=np.uint8)
+        self.average = None
+        self.small_alpha = np.empty((self.small_size[1], self.small_size[0]), dtype=np.uint8)
+        self.alpha = np.empty((size[1], size[0]), dtype=np.uint8)
+
+    def learn(self, frame):
+        cv2.resize(frame, self.small_size, dst=self.small, interpolation=cv2.INTER_AREA)
+        self.subtractor.apply(self.small, learningRate=self.learning_rate)
+
+    def matte(self, frame):
+        cv2.resize(frame, self.small_size, dst=self.small, interpolation=cv2.INTER_AREA)
+        foreground = self.subtractor.apply(self.small, learningRate=self.learning_rate)
+        # shadows come back as 127
+        cv2.threshold(foreground, 200, 255, cv2.THRESH_BINARY, dst=foreground)
+        cv2.morphologyEx(foreground, cv2.MORPH_OPEN, self.kernel, dst=foreground)
+        cv2.morphologyEx(foreground, cv2.MORPH_CLOSE, self.kernel, dst=foreground, iterations=2)
+        if self.average is None:
+            self.average = foreground.astype(np.float32)
+        else:
+            cv2.accumulateWeighted(foreground, self.average, self.smoothing)
+        cv2.convertScaleAbs(self.average, dst=self.small_alpha)
+        cv2.resize(self.small_alpha, self.size, dst=self.alpha, interpolation=cv2.INTER_LINEAR)
+        return compositing.feather_matte(self.alpha, self.feather)
+
+
+def replace_video_background(source, output_path, background=None, background_video=None, method="mog2",
+                             scale=0.5, smoothing=0.5, feather=compositing.DEFAULT_FEATHER, prime_frames=0,
+                             learning_rate=-1.0, queue_size=8):
+    # decode, matte and composite, encode each run on their own thread, the slowest one sets the pace
+    if prime_frames:
+        prime = cv2.VideoCapture(source)
+    reader = FrameReader(source, queue_size)
+    size = reader.size
+    model = MatteModel(size, method, scale, smoothing, feather, learning_rate)
+    if prime_frames:
+        # the model learns the empty scene from the start of the clip before anything is written
+        for _ in range(prime_frames):
+            ok, frame = prime.read()
+            if not ok:
+                break
+            model.learn(frame)
+        prime.release()
+    if background_video:
+        backgrounds = VideoBackground(background_video, size)
+    else:
+        backgrounds = StaticBackground(background, size)
+    writer = FrameWriter(output_path, reader.fps, size, queue_size)
+
+    reader.start()
+    writer.start()
+    start = time.perf_counter()
+    processed = 0
+    try:
+        while True:
+            frame = reader.frames.get()
+            if frame is None:
+                break
+            alpha = model.matte(frame)
+            writer.put(compositing.composite(frame, backgrounds.next(), alpha, writer.buffer()))
+            processed += 1
+    finally:
+        reader.stop()
+        writer.close()
+        backgrounds.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": processed,
+        "frames_written": writer.frames_written,
+        "seconds": elapsed,
+        "fps": processed / elapsed if elapsed else 0.0,
+        "source_fps": reader.fps,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replace the background of a video clip using a learned "
+                                                 "background model.")
+    parser.add_argument("video", help="input clip, shot from a fixed camera")
+    parser.add_argument("output", help="output clip, .mp4 or .avi")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--background", help="background image, resized once to the clip's size")
+    group.add_argument("--background-video", help="background clip, looped if shorter than the input")
+    group.add_argument("--color", type=parse_color, help="background colour as #rrggbb or b,g,r")
+    parser.add_argument("--method", choices=sorted(SUBTRACTORS), default="mog2", help="background subtractor")
+    parser.add_argument("--scale", type=float, default=0.5, help="scale the background model runs at")
+    parser.add_argument("--smoothing", type=float, default=0.5,
+                        help="weight of the newest mask in the running average, 1 for no smoothing")
+    parser.add_argument("--feather", type=int, default=compositing.DEFAULT_FEATHER,
+                        help="soft edge radius in pixels, 0 for a hard mask")
+    parser.add_argument("--prime", type=int, default=0,
+                        help="frames from the start of the clip the model learns from before processing")
+    parser.add_argument("--learning-rate", type=float, default=-1.0,
+                        help="how fast the model absorbs changes into the background, -1 picks it from the "
+                             "frame count; small values keep a subject that stands still from fading out")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames buffered between the threads")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    background = None
+    if args.background:
+        background = cv2.imread(args.background)
+        if background is None:
+            print(f"Cannot read background {args.background}")
+            return 1
+    elif args.color:
+        background = args.color
+    stats = replace_video_background(args.video, args.output, background, args.background_video, args.method,
+                                     args.scale, args.smoothing, args.feather, args.prime, args.learning_rate,
+                                     args.queue_size)
+    print(f"Processed {stats['frames']} frames in {stats['seconds']:.1f}s, {stats['fps']:.1f} fps "
+          f"(clip runs at {stats['source_fps']:.1f} fps)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
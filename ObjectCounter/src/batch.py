@@ -0,0 +1,191 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+import pipeline
+from buffers import BufferPool
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+CSV_FIELDS = ["path", "width", "height", "count", "areas", "centroids", "timings", "error"]
+
+# one pool per worker process, reused across images of the same size
+_worker_buffers = BufferPool()
+
+
+def iter_image_paths(source):
+    if os.path.isdir(source):
+        for entry in sorted(os.scandir(source), key=lambda e: e.name):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+    else:
+        for path in sorted(glob.iglob(source, recursive=True)):
+            if os.path.isfile(path):
+                yield path
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path, encoding="utf-8") as manifest:
+        return {line.rstrip("\n") for line in manifest if line.strip()}
+
+
+def process_path(path, threshold_value, iterations, scale_factor, pyramid=False):
+    record = {"path": path}
+    # whatever goes wrong on one image, a MemoryError on a huge scan included, ends up in its record
+    try:
+        start = time.perf_counter()
+        image = cv2.imread(path)
+        load_time = time.perf_counter() - start
+        if image is None:
+            record["error"] = "could not read image"
+            return record
+        record["height"], record["width"] = image.shape[:2]
+        record.update(pipeline.count_objects(image, threshold_value, iterations, scale_factor, pyramid,
+                                             _worker_buffers))
+    except Exception as e:
+        record["error"] = str(e) or type(e).__name__
+        return record
+    record["timings"] = {"load": load_time, **record["timings"]}
+    return record
+
+
+class ResultWriter:
+    def __init__(self, output_path, append=False):
+        self.is_csv = output_path.lower().endswith(".csv")
+        write_header = not (append and os.path.exists(output_path) and os.path.getsize(output_path) > 0)
+        self.file = open(output_path, "a" if append else "w", encoding="utf-8", newline="")
+        if self.is_csv:
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if write_header:
+                self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.is_csv:
+            row = {key: record.get(key, "") for key in CSV_FIELDS}
+            for key in ("areas", "centroids", "timings"):
+                if key in record:
+                    row[key] = json.dumps(record[key])
+            self.csv_writer.writerow(row)
+        else:
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_batch(source, output_path, workers=None, threshold_value=1, iterations=1, scale_factor=0.5,
+              manifest_path=None, resume=False, pyramid=False):
+    manifest_path = manifest_path or output_path + ".manifest"
+    done = load_manifest(manifest_path) if resume else set()
+    workers = workers or os.cpu_count() or 1
+    # only a few images per worker are in flight, so memory does not grow with the input set
+    max_in_flight = workers * 2
+
+    writer = ResultWriter(output_path, append=resume)
+    processed = failed = 0
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        with open(manifest_path, "a" if resume else "w", encoding="utf-8") as manifest:
+            in_flight = {}
+            options = (threshold_value, iterations, scale_factor, pyramid)
+
+            def record(result):
+                nonlocal processed, failed
+                writer.write(result)
+                processed += 1
+                # failed images stay out of the manifest, so a resumed run tries them again
+                if "error" in result:
+                    failed += 1
+                    return
+                manifest.write(result["path"] + "\n")
+                manifest.flush()
+
+            def replace_pool():
+                nonlocal executor
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+            def collect(futures):
+                # records the finished images, returns the paths lost with a dead worker
+                lost = []
+                for future in futures:
+                    path = in_flight.pop(future)
+                    try:
+                        record(future.result())
+                    except BrokenProcessPool:
+                        lost.append(path)
+                return lost
+
+            def recover(lost):
+                # a worker killed by the system, e.g. out of memory, takes the pool down with every image in it;
+                # they run again one at a time on a new pool, so only an image that kills a worker on its own fails
+                lost += collect(wait(in_flight)[0])
+                replace_pool()
+                for path in lost:
+                    try:
+                        record(executor.submit(process_path, path, *options).result())
+                    except BrokenProcessPool as e:
+                        record({"path": path, "error": f"worker process died: {e}"})
+                        replace_pool()
+
+            def drain(return_when):
+                lost = collect(wait(in_flight, return_when=return_when)[0])
+                if lost:
+                    recover(lost)
+
+            for path in iter_image_paths(source):
+                if path in done:
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    drain(FIRST_COMPLETED)
+                try:
+                    future = executor.submit(process_path, path, *options)
+                except BrokenProcessPool:
+                    recover([])
+                    future = executor.submit(process_path, path, *options)
+                in_flight[future] = path
+            while in_flight:
+                drain(FIRST_COMPLETED)
+    finally:
+        executor.shutdown()
+    writer.close()
+    return processed, failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count objects in a directory or glob of images.")
+    parser.add_argument("source", help="directory of images or a glob pattern such as 'scans/**/*.png'")
+    parser.add_argument("-o", "--output", required=True, help="results file, .jsonl or .csv")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--threshold", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=1, help="GrabCut iterations")
+    parser.add_argument("--scale", type=float, default=0.5, help="GrabCut working scale")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="coarse-to-fine GrabCut with full-resolution edges, --scale is ignored")
+    parser.add_argument("--manifest", default=None, help="completed-image manifest (default: <output>.manifest)")
+    parser.add_argument("--resume", action="store_true", help="skip images already listed in the manifest")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    processed, failed = run_batch(args.source, args.output, args.workers, args.threshold, args.iterations,
+                                  args.scale, args.manifest, args.resume, args.pyramid)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} images ({failed} failed) in {elapsed:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import argparse
+import math
+import time
+
+import cv2
+import numpy as np
+
+import labeling
+import pipeline
+
+
+def make_blobs(object_count, radius=8, spacing=22, seed=0):
+    # discs on a jittered grid never touch, and at radius 8 they are well above the area cut-off
+    rng = np.random.default_rng(seed)
+    per_row = math.ceil(math.sqrt(object_count))
+    size = per_row * spacing + spacing
+    binary = np.zeros((size, size), dtype=np.uint8)
+    for index in range(object_count):
+        row, col = divmod(index, per_row)
+        cx = spacing + col * spacing + int(rng.integers(-2, 3))
+        cy = spacing + row * spacing + int(rng.integers(-2, 3))
+        cv2.circle(binary, (cx, cy), radius, 255, -1)
+    return binary
+
+
+def time_best(function, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def contour_path(binary):
+    objects = pipeline.find_objects(binary)
+    return len(objects), pipeline.draw_objects(objects, binary.shape + (3,))
+
+
+def labeling_path(binary):
+    components = labeling.label_objects(binary)
+    return len(components), labeling.draw_components(components)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare contour-loop and connected-components counting.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'image':>11} {'contours':>10} {'labeling':>10} {'speedup':>8}  counts")
+    for object_count in args.sizes:
+        binary = make_blobs(object_count)
+        contour_time, (contour_count, _) = time_best(lambda: contour_path(binary), args.repeat)
+        label_time, (label_count, _) = time_best(lambda: labeling_path(binary), args.repeat)
+        agreement = "match" if contour_count == label_count else f"MISMATCH {contour_count} != {label_count}"
+        print(f"{object_count:>8} {binary.shape[1]:>5}x{binary.shape[0]:<5} {contour_time:>9.3f}s "
+              f"{label_time:>9.3f}s {contour_time / label_time:>7.1f}x  {agreement}")
+
+
+if __name__ == "__main__":
+    main()
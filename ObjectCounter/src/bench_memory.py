@@ -0,0 +1,95 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import labeling
+from buffers import BufferPool, take
+from cache import StageCache
+from segmenters import GrabCutSegmenter
+
+PREVIEW_SIZE = (500, 375)
+
+
+def make_image(megapixels, seed=0):
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    w = h * 4 // 3
+    image = np.full((h, w, 3), 40, dtype=np.uint8)
+    for _ in range(200):
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        color = tuple(int(c) for c in rng.integers(120, 255, 3))
+        cv2.circle(image, center, int(rng.integers(h // 80, h // 20)), color, -1)
+    return image
+
+
+def render(segmenter, image, params, buffers, slot):
+    binary = segmenter.segment(image, params)
+    components = labeling.label_objects(binary, labels=take(buffers, f"labels_{slot}", binary.shape, np.int32))
+    return labeling.draw_preview(components, PREVIEW_SIZE)
+
+
+def run_child(mode, scenario, megapixels, updates):
+    image = make_image(megapixels)
+    buffers = BufferPool() if mode == "pooled" else None
+    if buffers is not None:
+        buffers.reserve(image.shape)
+    segmenter = GrabCutSegmenter(StageCache(max_bytes=4 * 1024 * 1024 * 1024), buffers)
+    params = {"image_key": "bench", "threshold": 1, "iterations": 1}
+    render(segmenter, image, params, buffers, 0)
+
+    tracemalloc.start()
+    peaks = []
+    for update in range(1, updates + 1):
+        if scenario == "threshold":
+            params["threshold"] = 1 + update % 50
+        else:
+            params["iterations"] = 1 + update
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        render(segmenter, image, params, buffers, update % 2)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "mode": mode,
+        "scenario": scenario,
+        "peak_update_mb": max(peaks) / 2 ** 20,
+        "mean_update_mb": sum(peaks) / len(peaks) / 2 ** 20,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory per slider update with and without the buffer pool.")
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--updates", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "SCENARIO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.megapixels, args.updates)
+        return
+
+    print(f"{args.megapixels:g} MP, {args.updates} updates per run, each run in a fresh process")
+    print(f"{'scenario':<10} {'mode':<9} {'peak/update':>12} {'mean/update':>12} {'peak RSS':>10}")
+    for scenario in ("threshold", "iterations"):
+        for mode in ("baseline", "pooled"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", mode, scenario,
+                 "--megapixels", str(args.megapixels), "--updates", str(args.updates)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{scenario:<10} {mode:<9} {result['peak_update_mb']:>9.1f} MB {result['mean_update_mb']:>9.1f} MB "
+                  f"{result['peak_rss_mb']:>7.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
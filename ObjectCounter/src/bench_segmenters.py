@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import labeling
+from batch import iter_image_paths
+from segmenters import GrabCutSegmenter, create_segmenters
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and count agreement of every segmenter against GrabCut.")
+    parser.add_argument("source", help="directory of images or a glob pattern")
+    parser.add_argument("--threshold", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--canny-min", type=int, default=100)
+    parser.add_argument("--canny-max", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="relative count difference still counted as agreeing with GrabCut")
+    args = parser.parse_args()
+
+    params = {
+        "threshold": args.threshold,
+        "iterations": args.iterations,
+        "canny_min": args.canny_min,
+        "canny_max": args.canny_max,
+    }
+    # no cache, every engine pays its full cost on every image
+    segmenters = create_segmenters()
+    latencies = {name: [] for name in segmenters}
+    agreements = {name: 0 for name in segmenters}
+    count_errors = {name: [] for name in segmenters}
+    image_count = 0
+
+    for path in iter_image_paths(args.source):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image_count += 1
+        counts = {}
+        for name, segmenter in segmenters.items():
+            start = time.perf_counter()
+            binary = segmenter.segment(image, params)
+            counts[name] = len(labeling.label_objects(binary))
+            latencies[name].append(time.perf_counter() - start)
+        reference = counts[GrabCutSegmenter.name]
+        for name, count in counts.items():
+            error = abs(count - reference) / max(reference, 1)
+            count_errors[name].append(error)
+            agreements[name] += error <= args.tolerance
+
+    if not image_count:
+        print("No images found")
+        return
+
+    print(f"{image_count} images, agreement = count within {args.tolerance:.0%} of GrabCut")
+    print(f"{'method':<20} {'p50 ms':>9} {'p95 ms':>9} {'agree':>7} {'mean err':>9}")
+    for name in segmenters:
+        print(f"{name:<20} {percentile_ms(latencies[name], 50):>9.1f} {percentile_ms(latencies[name], 95):>9.1f} "
+              f"{agreements[name] / image_count:>7.0%} {np.mean(count_errors[name]):>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
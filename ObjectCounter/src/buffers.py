@@ -0,0 +1,37 @@
+import numpy as np
+
+
+class BufferPool:
+    def __init__(self):
+        self._buffers = {}
+
+    def __contains__(self, name):
+        return name in self._buffers
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def get(self, name, shape, dtype=np.uint8):
+        shape = tuple(shape)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def reserve(self, image_shape):
+        # full-resolution buffers every update writes to, allocated once per loaded image
+        h, w = image_shape[:2]
+        self._buffers.clear()
+        self.get("segmented", (h, w, 3))
+        self.get("binary", (h, w))
+        self.get("labels_0", (h, w), np.int32)
+        self.get("labels_1", (h, w), np.int32)
+
+    def clear(self):
+        self._buffers.clear()
+
+
+def take(pool, name, shape, dtype=np.uint8):
+    return None if pool is None else pool.get(name, shape, dtype)
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class StageCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        size = self._nbytes(value)
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+        # entries larger than the whole budget are computed but never stored
+        if size > self.max_bytes:
+            return value
+        self._entries[key] = (value, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+        return value
+
+    def get_or_compute(self, key, compute):
+        if key in self._entries:
+            return self.get(key)
+        return self.put(key, compute())
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    @staticmethod
+    def _nbytes(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(StageCache._nbytes(item) for item in value)
+        return 0
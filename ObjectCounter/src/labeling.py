@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+MIN_OBJECT_AREA = 100
+# numbering every blob is unreadable past this point and putText becomes the bottleneck
+MAX_TEXT_LABELS = 2000
+LUT_STRIP_ROWS = 256
+
+
+class Components:
+    def __init__(self, labels, stats, centroids, keep):
+        self.labels = labels
+        # lookup from raw label to 1-based object number, 0 for background and filtered blobs
+        self.object_ids = np.zeros(len(stats), dtype=np.int32)
+        self.object_ids[keep] = np.arange(1, np.count_nonzero(keep) + 1, dtype=np.int32)
+        self.keep = keep
+        self.areas = stats[keep, cv2.CC_STAT_AREA]
+        self.bboxes = stats[keep, :cv2.CC_STAT_AREA]
+        self.centroids = centroids[keep]
+        self.colors = None
+
+    def __len__(self):
+        return len(self.areas)
+
+
+def label_objects(binary_image, min_area=MIN_OBJECT_AREA, connectivity=8, labels=None):
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_image, labels=labels,
+                                                                   connectivity=connectivity, ltype=cv2.CV_32S)
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False
+    return Components(labels, stats, centroids, keep)
+
+
+def component_colors(components):
+    # picked once per result, so the preview and the saved full-resolution image agree
+    if components.colors is None:
+        colors = np.random.randint(0, 255, (len(components.keep), 3), dtype=np.uint8)
+        colors[~components.keep] = 0
+        components.colors = colors
+    return components.colors
+
+
+def draw_components(components, max_text_labels=MAX_TEXT_LABELS, out=None):
+    return _paint(components.labels, component_colors(components), components.centroids, max_text_labels, out,
+                  0.8, 2)
+
+
+def draw_preview(components, size, max_text_labels=MAX_TEXT_LABELS, out=None):
+    labels = cv2.resize(components.labels, size, interpolation=cv2.INTER_NEAREST)
+    scale = size[0] / components.labels.shape[1]
+    return _paint(labels, component_colors(components), components.centroids * scale, max_text_labels, out,
+                  0.4, 1)
+
+
+def _paint(labels, colors, centroids, max_text_labels, out, font_scale, thickness):
+    result = np.empty(labels.shape + (3,), dtype=np.uint8) if out is None else out
+    # np.take converts the int32 labels to intp, so go in strips to keep that copy small;
+    # mode="clip" lets it write straight into result instead of through a temporary
+    for y in range(0, labels.shape[0], LUT_STRIP_ROWS):
+        np.take(colors, labels[y:y + LUT_STRIP_ROWS], axis=0, out=result[y:y + LUT_STRIP_ROWS], mode="clip")
+    if len(centroids) <= max_text_labels:
+        for number, (cx, cy) in enumerate(centroids.astype(np.int32).tolist(), start=1):
+            cv2.putText(result, str(number), (cx, cy), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255),
+                        thickness)
+    return result
@@ -1,3 +1,4 @@
+import os
 import sys
 import cv2
 import numpy as np
@@ -6,7 +7,79 @@ from PyQt6.QtWidgets import (
     QFileDialog, QSlider, QComboBox, QWidget
 )
 from PyQt6.QtGui import QPixmap, QImage
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+
+import labeling
+import video
+from buffers import BufferPool
+from cache import StageCache
+from measurements import ObjectTable
+from segmenters import create_segmenters
+
+
+class ClickableLabel(QLabel):
+    clicked = pyqtSignal(int, int)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            point = event.position().toPoint()
+            self.clicked.emit(point.x(), point.y())
+
+
+class SegmentationSignals(QObject):
+    finished = pyqtSignal(int, object, object)
+    measured = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+class SegmentationTask(QRunnable):
+    def __init__(self, generation, job, params, measure=None):
+        super().__init__()
+        self.generation = generation
+        self.job = job
+        self.params = params
+        self.measure = measure
+        self.signals = SegmentationSignals()
+
+    def run(self):
+        try:
+            preview, components = self.job(self.params)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.finished.emit(self.generation, preview, components)
+        if self.measure is None:
+            return
+        # the preview is already on its way, the table follows from the same worker
+        try:
+            table = self.measure(self.generation, components, self.params)
+        except Exception as e:
+            print(f"Error in measuring objects: {e}")
+            return
+        if table is not None:
+            self.signals.measured.emit(self.generation, table)
+
+
+class VideoSignals(QObject):
+    frame = pyqtSignal(object, int)
+    finished = pyqtSignal(object)
+
+
+class VideoTask(QRunnable):
+    def __init__(self, counter, preview_size):
+        super().__init__()
+        self.counter = counter
+        self.preview_size = preview_size
+        self.signals = VideoSignals()
+
+    def run(self):
+        try:
+            for _, _, frame, boxes, ids in self.counter.frames():
+                preview = video.draw_tracks(frame, boxes, ids, self.preview_size)
+                self.signals.frame.emit(preview, self.counter.tracker.count)
+        except Exception as e:
+            print(f"Error in video counting: {e}")
+        self.signals.finished.emit(self.counter.stats())
 
 
 class ObjectCounterApp(QMainWindow):
@@ -16,27 +89,56 @@ class ObjectCounterApp(QMainWindow):
         self.setGeometry(100, 100, 1200, 700)
 
         self.image = None
-        self.processed_image = None
-        self.grabcut_cache = {}
+        self.image_key = None
+        self.components = None
+        self.object_table = None
+        self.input_pixmap = None
+        self.grabcut_cache = StageCache(max_bytes=1024 * 1024 * 1024)
+        self.buffers = BufferPool()
+        # labels go into one of two buffers, never the one behind the result on screen
+        self.displayed_slot = 0
+        self.segmenters = create_segmenters(self.grabcut_cache, self.buffers)
+
+        # a single worker runs at a time; while it is busy only the newest request is kept
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(1)
+        self.running_task = None
+        self.pending_params = None
+        self.generation = 0
+
+        self.video_pool = QThreadPool()
+        self.video_pool.setMaxThreadCount(1)
+        self.video_task = None
 
         self._initialize_ui()
 
     def _initialize_ui(self):
         main_layout = QHBoxLayout()
         self.input_label = self._create_image_label("Input Image")
-        self.output_label = self._create_image_label("Processed Image")
+        self.output_label = self._create_image_label("Processed Image", ClickableLabel)
+        # pixmap offsets are computed for a centred pixmap when mapping clicks back to the image
+        self.output_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.output_label.clicked.connect(self.inspect_object)
 
         main_layout.addWidget(self.input_label)
         main_layout.addWidget(self.output_label)
 
         control_layout = QVBoxLayout()
-        control_layout.addWidget(self._create_button("Load Image", self.load_image))
+        self.load_image_button = self._create_button("Load Image", self.load_image)
+        control_layout.addWidget(self.load_image_button)
+        control_layout.addWidget(self._create_button("Load Video", self.load_video))
         self.save_button = self._create_button("Save Image", self.save_image, enabled=False)
         control_layout.addWidget(self.save_button)
+        self.export_button = self._create_button("Export Table", self.export_table, enabled=False)
+        control_layout.addWidget(self.export_button)
+        self.cancel_button = self._create_button("Cancel", self.cancel_processing, enabled=False)
+        control_layout.addWidget(self.cancel_button)
         self.method_selector = self._create_method_selector()
         control_layout.addWidget(self.method_selector)
         self.object_count_label = QLabel("Objects Found: 0")
         control_layout.addWidget(self.object_count_label)
+        self.inspect_label = QLabel("Click an object to inspect it")
+        control_layout.addWidget(self.inspect_label)
         self.sliders = self._initialize_sliders(control_layout)
         main_layout.addLayout(control_layout)
 
@@ -44,8 +146,8 @@ class ObjectCounterApp(QMainWindow):
         widget.setLayout(main_layout)
         self.setCentralWidget(widget)
 
-    def _create_image_label(self, text):
-        label = QLabel(text)
+    def _create_image_label(self, text, label_class=QLabel):
+        label = label_class(text)
         label.setFixedSize(500, 500)
         label.setStyleSheet("border: 1px solid black;")
         return label
@@ -58,7 +160,7 @@ class ObjectCounterApp(QMainWindow):
 
     def _create_method_selector(self):
         selector = QComboBox()
-        selector.addItems(["GrabCut"])
+        selector.addItems(list(self.segmenters))
         selector.currentTextChanged.connect(self.update_image)
         return selector
 
@@ -88,65 +190,203 @@ class ObjectCounterApp(QMainWindow):
         file_path, _ = QFileDialog.getOpenFileName(self, "Open Image File", "", "Images (*.png *.jpg *.jpeg *.bmp)")
         if file_path:
             self.image = cv2.imread(file_path)
-            self.display_image(self.image, self.input_label)
+            # results stay cached per file version, so reloading an image reuses them
+            self.image_key = (file_path, os.path.getmtime(file_path))
+            self.components = None
+            self.object_table = None
+            self.export_button.setEnabled(False)
+            self.buffers.reserve(self.image.shape)
+            self.input_pixmap = self._preview_pixmap(self.image, self.input_label)
+            self.input_label.setPixmap(self.input_pixmap)
             self.save_button.setEnabled(True)
-            self.grabcut_cache.clear()
             self.update_image()
 
     def save_image(self):
-        if self.processed_image is not None:
+        if self.components is not None:
             file_path, _ = QFileDialog.getSaveFileName(self, "Save Image File", "", "Images (*.png *.jpg *.bmp)")
             if file_path:
-                cv2.imwrite(file_path, self.processed_image)
+                # the only place the full-resolution result is drawn
+                cv2.imwrite(file_path, labeling.draw_components(self.components))
+
+    def export_table(self):
+        table = self.object_table
+        if table is not None:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Export Object Table", "",
+                                                       "Tables (*.csv *.npz *.parquet)")
+            if file_path:
+                try:
+                    table.save(file_path)
+                except ImportError as e:
+                    print(e)
+
+    def inspect_object(self, x, y):
+        pixmap = self.output_label.pixmap()
+        table = self.object_table
+        if table is None and self.components is not None:
+            self.inspect_label.setText("Still measuring objects")
+            return
+        if table is None or pixmap is None or pixmap.isNull():
+            return
+        labels = self.components.labels
+        # the label image answers "which object is here" directly, no search over objects
+        scale = labels.shape[1] / pixmap.width()
+        image_x = int((x - (self.output_label.width() - pixmap.width()) / 2) * scale)
+        image_y = int((y - (self.output_label.height() - pixmap.height()) / 2) * scale)
+        row = None
+        if 0 <= image_x < labels.shape[1] and 0 <= image_y < labels.shape[0]:
+            row = table.row_for_id(int(self.components.object_ids[labels[image_y, image_x]]))
+        if row is None:
+            self.inspect_label.setText("No object here")
+            return
+        values = table.row(row)
+        self.inspect_label.setText(
+            f"Object {values['id']}: area {values['area']}, perimeter {values['perimeter']}\n"
+            f"box {values['x']},{values['y']} {values['width']}x{values['height']}, "
+            f"centroid {values['cx']:.0f},{values['cy']:.0f}\n"
+            f"mean BGR {values['mean_b']:.0f},{values['mean_g']:.0f},{values['mean_r']:.0f}"
+        )
 
     def update_image(self):
-        if self.image is None:
+        # the output label belongs to a running video, image results would overwrite its frames
+        if self.image is None or self.video_task is not None:
+            return
+        # sliders are read here on the GUI thread, the worker only sees this snapshot
+        self.generation += 1
+        self.pending_params = {
+            "method": self.method_selector.currentText(),
+            "image": self.image,
+            "image_key": self.image_key,
+            "threshold": self.sliders["threshold"].value(),
+            "iterations": self.sliders["iterations"].value(),
+            "canny_min": self.sliders["canny_min"].value(),
+            "canny_max": self.sliders["canny_max"].value(),
+            "preview_size": self._preview_size(self.image.shape, self.output_label),
+        }
+        self._start_next_task()
+
+    def cancel_processing(self):
+        # a running grabCut cannot be interrupted, but its result will be dropped
+        self.generation += 1
+        self.pending_params = None
+        if self.video_task is not None:
+            self.video_task.counter.stop()
             return
-        if self.method_selector.currentText() == "GrabCut":
-            self._apply_grabcut()
-
-    def _apply_grabcut(self):
-        scale_factor = 0.5
-        small_image = cv2.resize(self.image, (0, 0), fx=scale_factor, fy=scale_factor)
-        mask = np.zeros(small_image.shape[:2], dtype=np.uint8)
-        rect = (10, 10, small_image.shape[1] - 20, small_image.shape[0] - 20)
-        bgd_model = np.zeros((1, 65), dtype=np.float64)
-        fgd_model = np.zeros((1, 65), dtype=np.float64)
-        cv2.grabCut(small_image, mask, rect, bgd_model, fgd_model, self.sliders["iterations"].value(), cv2.GC_INIT_WITH_RECT)
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype("uint8")
-        segmented_small = small_image * mask2[:, :, np.newaxis]
-        segmented = cv2.resize(segmented_small, (self.image.shape[1], self.image.shape[0]))
-        threshold_value = self.sliders["threshold"].value()
-        gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, threshold_value, 255, cv2.THRESH_BINARY)
-        self._detect_and_draw_contours(binary)
-
-    def _detect_and_draw_contours(self, binary_image):
-        contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        result = np.zeros_like(self.image)
-        object_count = 0
-        for contour in contours:
-            if cv2.contourArea(contour) < 100:
-                continue
-            color = tuple(np.random.randint(0, 255, 3).tolist())
-            cv2.drawContours(result, [contour], -1, color, -1)
-            moments = cv2.moments(contour)
-            if moments["m00"] != 0:
-                cx = int(moments["m10"] / moments["m00"])
-                cy = int(moments["m01"] / moments["m00"])
-                cv2.putText(result, str(object_count + 1), (cx, cy), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-            object_count += 1
-        self.object_count_label.setText(f"Objects Found: {object_count}")
-        self.processed_image = result
-        self.display_image(result, self.output_label)
+        self.object_count_label.setText("Objects Found: cancelled")
+
+    def load_video(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Video File", "", "Videos (*.mp4 *.avi *.mov *.mkv)")
+        if not file_path or self.video_task is not None:
+            return
+        method = self.method_selector.currentText()
+        if not self.segmenters[method].realtime:
+            method = video.DEFAULT_METHOD
+        params = {
+            "threshold": self.sliders["threshold"].value(),
+            "canny_min": self.sliders["canny_min"].value(),
+            "canny_max": self.sliders["canny_max"].value(),
+        }
+        try:
+            counter = video.VideoCounter(file_path, method, params, realtime=True)
+        except IOError as e:
+            print(e)
+            return
+        frame_shape = (int(counter.reader.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                       int(counter.reader.capture.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        self.video_task = VideoTask(counter, self._preview_size(frame_shape, self.output_label))
+        self.video_task.signals.frame.connect(self._on_video_frame)
+        self.video_task.signals.finished.connect(self._on_video_finished)
+        # image processing stays off until the video ends, a result still on its way is dropped
+        self.generation += 1
+        self.pending_params = None
+        self.load_image_button.setEnabled(False)
+        self.components = None
+        self.object_table = None
+        self.save_button.setEnabled(False)
+        self.export_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.video_pool.start(self.video_task)
+
+    def _on_video_frame(self, preview, object_count):
+        self.object_count_label.setText(f"Objects Counted: {object_count}")
+        self.display_image(preview, self.output_label)
+
+    def _on_video_finished(self, stats):
+        self.video_task = None
+        self.load_image_button.setEnabled(True)
+        self.cancel_button.setEnabled(self.running_task is not None)
+        self.object_count_label.setText(
+            f"Objects Counted: {stats['objects']} ({stats['fps']:.0f} fps, {stats['dropped_frames']} dropped)"
+        )
+
+    def _start_next_task(self):
+        if self.running_task is not None or self.pending_params is None:
+            return
+        self.pending_params["result_slot"] = 1 - self.displayed_slot
+        task = SegmentationTask(self.generation, self._process, self.pending_params, self._measure)
+        task.signals.finished.connect(self._on_task_finished)
+        task.signals.measured.connect(self._on_task_measured)
+        task.signals.failed.connect(self._on_task_failed)
+        self.pending_params = None
+        self.running_task = task
+        self.cancel_button.setEnabled(True)
+        self.thread_pool.start(task)
+
+    def _on_task_finished(self, generation, preview, components):
+        if generation == self.generation:
+            self.object_count_label.setText(f"Objects Found: {len(components)}")
+            self.components = components
+            self.object_table = None
+            self.display_image(preview, self.output_label)
+            self.displayed_slot ^= 1
+        self._task_done()
+
+    def _on_task_measured(self, generation, table):
+        if generation == self.generation:
+            self.object_table = table
+            self.export_button.setEnabled(True)
+
+    def _on_task_failed(self, generation, message):
+        self._task_done()
+        if generation == self.generation:
+            print(f"Error in segmentation: {message}")
+
+    def _task_done(self):
+        self.running_task = None
+        self.cancel_button.setEnabled(self.pending_params is not None)
+        self._start_next_task()
+
+    def _process(self, params):
+        binary = self.segmenters[params["method"]].segment(params["image"], params)
+        return self._detect_and_draw_contours(binary, params)
+
+    def _measure(self, generation, components, params):
+        # a table for a result that was already replaced is not worth building; the next task queues behind
+        # this one on the single worker, so the labels are not overwritten while they are measured
+        if generation != self.generation:
+            return None
+        return ObjectTable.from_components(components, params["image"])
+
+    def _detect_and_draw_contours(self, binary_image, params):
+        labels = self.buffers.get(f"labels_{params['result_slot']}", binary_image.shape, np.int32)
+        components = labeling.label_objects(binary_image, labels=labels)
+        return labeling.draw_preview(components, params["preview_size"]), components
 
     def display_image(self, image, label):
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-        pixmap = QPixmap.fromImage(qt_image).scaled(label.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        label.setPixmap(pixmap)
+        label.setPixmap(self._preview_pixmap(image, label))
+
+    def _preview_size(self, image_shape, label):
+        h, w = image_shape[:2]
+        scale = min(label.width() / w, label.height() / h, 1.0)
+        return max(1, round(w * scale)), max(1, round(h * scale))
+
+    def _preview_pixmap(self, image, label):
+        size = self._preview_size(image.shape, label)
+        if size != (image.shape[1], image.shape[0]):
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        # Qt reads the BGR bytes as they are, fromImage then copies them into the pixmap
+        h, w = image.shape[:2]
+        qt_image = QImage(image.data, w, h, image.strides[0], QImage.Format.Format_BGR888)
+        return QPixmap.fromImage(qt_image)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import numpy as np
+
+COLUMNS = ("id", "area", "x", "y", "width", "height", "cx", "cy", "perimeter", "mean_b", "mean_g", "mean_r")
+CSV_FORMATS = ("%d", "%d", "%d", "%d", "%d", "%d", "%.2f", "%.2f", "%d", "%.2f", "%.2f", "%.2f")
+
+
+class ObjectTable:
+    def __init__(self, columns):
+        self.columns = columns
+        self._id_to_row = None
+
+    @classmethod
+    def from_components(cls, components, image):
+        labels = components.labels
+        raw_count = len(components.keep)
+        keep = components.keep
+
+        # every per-object reduction is one bincount over the label image, whatever the object count
+        flat_labels = labels.ravel()
+        means = []
+        for channel in range(3):
+            sums = np.bincount(flat_labels, weights=image[:, :, channel].ravel(), minlength=raw_count)
+            means.append(sums[keep] / components.areas)
+
+        columns = {
+            "id": components.object_ids[keep],
+            "area": components.areas.astype(np.int64),
+            "x": components.bboxes[:, 0],
+            "y": components.bboxes[:, 1],
+            "width": components.bboxes[:, 2],
+            "height": components.bboxes[:, 3],
+            "cx": components.centroids[:, 0],
+            "cy": components.centroids[:, 1],
+            "perimeter": boundary_pixel_counts(labels, raw_count)[keep],
+            "mean_b": means[0],
+            "mean_g": means[1],
+            "mean_r": means[2],
+        }
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def row(self, index):
+        return {name: self.columns[name][index].item() for name in COLUMNS}
+
+    def row_for_id(self, object_id):
+        if self._id_to_row is None:
+            ids = self.columns["id"]
+            self._id_to_row = np.full(int(ids.max(initial=0)) + 1, -1, dtype=np.int64)
+            self._id_to_row[ids] = np.arange(len(ids))
+        if not 0 < object_id < len(self._id_to_row):
+            return None
+        row = self._id_to_row[object_id]
+        return None if row < 0 else int(row)
+
+    def take(self, indices):
+        return ObjectTable({name: column[indices] for name, column in self.columns.items()})
+
+    def sort(self, column, descending=False):
+        order = np.argsort(self.columns[column], kind="stable")
+        return self.take(order[::-1] if descending else order)
+
+    def filter(self, **ranges):
+        # filter(area=(500, None), mean_r=(None, 80)) keeps rows inside every (low, high) range
+        keep = np.ones(len(self), dtype=bool)
+        for name, (low, high) in ranges.items():
+            if low is not None:
+                keep &= self.columns[name] >= low
+            if high is not None:
+                keep &= self.columns[name] <= high
+        return self.take(keep)
+
+    def save(self, path):
+        if path.lower().endswith(".parquet"):
+            self.to_parquet(path)
+        elif path.lower().endswith(".npz"):
+            self.to_npz(path)
+        else:
+            self.to_csv(path)
+
+    def to_csv(self, path):
+        data = np.column_stack([self.columns[name].astype(np.float64) for name in COLUMNS])
+        np.savetxt(path, data, fmt=CSV_FORMATS, delimiter=",", header=",".join(COLUMNS), comments="")
+
+    def to_npz(self, path):
+        np.savez(path, **self.columns)
+
+    def to_parquet(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow, use .npz or .csv instead") from None
+        table = pyarrow.table({name: self.columns[name] for name in COLUMNS})
+        pyarrow.parquet.write_table(table, path)
+
+
+def boundary_pixel_counts(labels, raw_count):
+    # a pixel is on the boundary when one of its 4-neighbours carries a different label
+    boundary = np.zeros(labels.shape, dtype=bool)
+    changed = labels[1:, :] != labels[:-1, :]
+    boundary[1:, :] |= changed
+    boundary[:-1, :] |= changed
+    changed = labels[:, 1:] != labels[:, :-1]
+    boundary[:, 1:] |= changed
+    boundary[:, :-1] |= changed
+    # objects touching the image border are closed by the border
+    boundary[[0, -1], :] = True
+    boundary[:, [0, -1]] = True
+    return np.bincount(labels[boundary], minlength=raw_count)
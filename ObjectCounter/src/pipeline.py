@@ -0,0 +1,186 @@
+import time
+import cv2
+import numpy as np
+
+import labeling
+from buffers import take
+from labeling import MIN_OBJECT_AREA
+
+# the pyramid is halved until the coarsest level fits in this many pixels per side
+PYRAMID_COARSE_SIDE = 512
+# half-width in pixels of the boundary band re-segmented at each finer level
+PYRAMID_BAND = 3
+PYRAMID_BLOCK = 128
+
+
+def grabcut_rect(image_shape, margin=10):
+    return (margin, margin, image_shape[1] - 2 * margin, image_shape[0] - 2 * margin)
+
+
+def downscale(image, scale_factor):
+    return cv2.resize(image, (0, 0), fx=scale_factor, fy=scale_factor)
+
+
+def grabcut_iterate(small_image, rect, state=None, iterations=1):
+    if state is None:
+        mask = np.zeros(small_image.shape[:2], dtype=np.uint8)
+        bgd_model = np.zeros((1, 65), dtype=np.float64)
+        fgd_model = np.zeros((1, 65), dtype=np.float64)
+        # fixed k-means seed, so resuming from a saved state matches a run from scratch
+        cv2.setRNGSeed(0)
+        mode = cv2.GC_INIT_WITH_RECT
+    else:
+        mask, bgd_model, fgd_model = (array.copy() for array in state)
+        mode = cv2.GC_EVAL
+    cv2.grabCut(small_image, mask, rect, bgd_model, fgd_model, iterations, mode)
+    return mask, bgd_model, fgd_model
+
+
+def segment_grabcut(small_image, rect, iterations, full_shape, buffers=None):
+    mask, _, _ = grabcut_iterate(small_image, rect, iterations=iterations)
+    return grabcut_mask_to_gray(small_image, mask, full_shape, buffers)
+
+
+def grabcut_mask_to_gray(small_image, mask, full_shape, buffers=None):
+    h, w = full_shape[:2]
+    # GC_FGD and GC_PR_FGD are the odd mask values
+    mask2 = cv2.bitwise_and(mask, 1, dst=take(buffers, "grabcut_foreground", mask.shape))
+    segmented_small = np.multiply(small_image, mask2[:, :, np.newaxis],
+                                  out=take(buffers, "segmented_small", small_image.shape))
+    segmented = cv2.resize(segmented_small, (w, h), dst=take(buffers, "segmented", (h, w, 3)))
+    # the grayscale result is kept by the stage cache, so it always gets its own array
+    return cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
+
+
+def pyramid_depth(image_shape, coarse_side=PYRAMID_COARSE_SIDE):
+    depth = 0
+    side = max(image_shape[:2])
+    while side > coarse_side:
+        side = (side + 1) // 2
+        depth += 1
+    return depth
+
+
+def segment_grabcut_pyramid(image, iterations, depth=None, margin=20):
+    depth = pyramid_depth(image.shape) if depth is None else depth
+    levels = [image]
+    for _ in range(depth):
+        h, w = levels[-1].shape[:2]
+        levels.append(cv2.resize(levels[-1], ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA))
+
+    coarse = levels[-1]
+    mask = np.zeros(coarse.shape[:2], dtype=np.uint8)
+    bgd_model = np.zeros((1, 65), dtype=np.float64)
+    fgd_model = np.zeros((1, 65), dtype=np.float64)
+    rect = grabcut_rect(coarse.shape, max(1, margin >> depth))
+    cv2.grabCut(coarse, mask, rect, bgd_model, fgd_model, iterations, cv2.GC_INIT_WITH_RECT)
+    foreground = ((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)).astype(np.uint8)
+
+    for level in reversed(levels[:-1]):
+        foreground = cv2.resize(foreground, (level.shape[1], level.shape[0]), interpolation=cv2.INTER_NEAREST)
+        foreground = _refine_boundary(level, foreground, bgd_model, fgd_model)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray[foreground == 0] = 0
+    return gray
+
+
+def _refine_boundary(image, foreground, bgd_model, fgd_model, band=PYRAMID_BAND, block=PYRAMID_BLOCK):
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+    inner = cv2.erode(foreground, kernel)
+    outer = cv2.dilate(foreground, kernel)
+
+    # pixels away from the upsampled boundary are fixed, only the band is left for grabCut to decide
+    gc_mask = np.full(foreground.shape, cv2.GC_BGD, dtype=np.uint8)
+    gc_mask[outer == 1] = cv2.GC_PR_BGD
+    gc_mask[foreground == 1] = cv2.GC_PR_FGD
+    gc_mask[inner == 1] = cv2.GC_FGD
+    uncertain = outer != inner
+
+    refined = foreground.copy()
+    h, w = foreground.shape
+    pad = 2 * band
+    for y in range(0, h, block):
+        for x in range(0, w, block):
+            block_uncertain = uncertain[y:y + block, x:x + block]
+            rows = np.flatnonzero(block_uncertain.any(axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(block_uncertain.any(axis=0))
+            # grabCut only sees the band inside this block plus enough fixed pixels around it for context
+            y0, y1 = max(0, y + rows[0] - pad), min(h, y + rows[-1] + 1 + pad)
+            x0, x1 = max(0, x + cols[0] - pad), min(w, x + cols[-1] + 1 + pad)
+            block_mask = gc_mask[y0:y1, x0:x1].copy()
+            is_foreground = (block_mask == cv2.GC_FGD) | (block_mask == cv2.GC_PR_FGD)
+            if is_foreground.all() or not is_foreground.any():
+                continue
+            # starting from the coarse colour models skips the k-means initialisation in every block
+            cv2.grabCut(np.ascontiguousarray(image[y0:y1, x0:x1]), block_mask, None, bgd_model.copy(),
+                        fgd_model.copy(), 1, cv2.GC_EVAL)
+            block_foreground = (block_mask == cv2.GC_FGD) | (block_mask == cv2.GC_PR_FGD)
+            by0, by1 = max(y0, y), min(y1, y + block)
+            bx0, bx1 = max(x0, x), min(x1, x + block)
+            refined[by0:by1, bx0:bx1] = block_foreground[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0]
+    return refined
+
+
+def threshold(gray, threshold_value, dst=None):
+    _, binary = cv2.threshold(gray, threshold_value, 255, cv2.THRESH_BINARY, dst=dst)
+    return binary
+
+
+def find_objects(binary_image, min_area=MIN_OBJECT_AREA):
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    objects = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+        moments = cv2.moments(contour)
+        centroid = None
+        if moments["m00"] != 0:
+            centroid = (int(moments["m10"] / moments["m00"]), int(moments["m01"] / moments["m00"]))
+        objects.append((contour, area, centroid))
+    return objects
+
+
+def draw_objects(objects, image_shape):
+    result = np.zeros(image_shape, dtype=np.uint8)
+    for number, (contour, _, centroid) in enumerate(objects, start=1):
+        color = tuple(np.random.randint(0, 255, 3).tolist())
+        cv2.drawContours(result, [contour], -1, color, -1)
+        if centroid is not None:
+            cv2.putText(result, str(number), centroid, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    return result
+
+
+def count_objects(image, threshold_value=1, iterations=1, scale_factor=0.5, pyramid=False, buffers=None):
+    timings = {}
+
+    if pyramid:
+        start = time.perf_counter()
+        gray = segment_grabcut_pyramid(image, iterations)
+        timings["grabcut"] = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        small_image = downscale(image, scale_factor)
+        timings["downscale"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gray = segment_grabcut(small_image, grabcut_rect(small_image.shape), iterations, image.shape, buffers)
+        timings["grabcut"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    binary = threshold(gray, threshold_value, take(buffers, "binary", gray.shape))
+    timings["threshold"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    components = labeling.label_objects(binary, labels=take(buffers, "labels", binary.shape, np.int32))
+    timings["labeling"] = time.perf_counter() - start
+
+    return {
+        "count": len(components),
+        "areas": components.areas.tolist(),
+        "centroids": np.round(components.centroids, 1).tolist(),
+        "timings": timings,
+    }
@@ -0,0 +1,230 @@
+import cv2
+import numpy as np
+
+import pipeline
+from buffers import take
+
+
+class Segmenter:
+    name = None
+    # cheap enough to run on every frame of a video
+    realtime = False
+    # pixels of context a tile needs on each side to come out exactly as in the whole image,
+    # None when every pixel depends on the whole image and the segmenter cannot run tiled
+    halo = None
+
+    def __init__(self, cache=None, buffers=None):
+        self.cache = cache
+        self.buffers = buffers
+
+    def segment(self, image, params):
+        raise NotImplementedError
+
+    def tile_statistics(self, image, params, core):
+        # whole-image measurements segment() depends on, as an array that adds up over the tile cores;
+        # the sum comes back to segment() as params["statistics"]
+        return None
+
+    def _cached(self, params, key, compute):
+        if self.cache is None or params.get("image_key") is None:
+            return compute()
+        return self.cache.get_or_compute((params["image_key"],) + key, compute)
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        return take(self.buffers, name, shape, dtype)
+
+    @staticmethod
+    def _objects_as_minority(binary, foreground=None, total=None):
+        # thresholding does not know which side the objects are on, assume they cover less than half the frame;
+        # a tile passes the counts of the whole image so every tile picks the same side
+        if foreground is None:
+            foreground, total = cv2.countNonZero(binary), binary.size
+        if foreground > total // 2:
+            cv2.bitwise_not(binary, binary)
+        return binary
+
+
+class GrabCutSegmenter(Segmenter):
+    name = "GrabCut"
+    scale_factor = 0.5
+
+    def segment(self, image, params):
+        iterations = params["iterations"]
+        small_image = self._cached(params, ("small", self.scale_factor),
+                                   lambda: pipeline.downscale(image, self.scale_factor))
+        rect = pipeline.grabcut_rect(small_image.shape)
+        # the full-size grayscale of the segmented image only depends on the grabcut
+        # parameters, so a threshold change goes straight from here to the contours
+        gray = self._cached(
+            params, ("segmented_gray", self.scale_factor, iterations, rect),
+            lambda: pipeline.grabcut_mask_to_gray(
+                small_image, self._grabcut_state(params, small_image, rect, iterations)[0], image.shape,
+                self.buffers
+            )
+        )
+        return pipeline.threshold(gray, params["threshold"], self._buffer("binary", gray.shape))
+
+    def _grabcut_state(self, params, small_image, rect, iterations):
+        if self.cache is None or params.get("image_key") is None:
+            return pipeline.grabcut_iterate(small_image, rect, iterations=iterations)
+        key = (params["image_key"], "grabcut_state", self.scale_factor, rect)
+        done, state = 0, None
+        for cached_iterations in range(iterations, 0, -1):
+            state = self.cache.get(key + (cached_iterations,))
+            if state is not None:
+                done = cached_iterations
+                break
+        # resume from the closest earlier snapshot and keep one per iteration,
+        # so going up costs the missing iterations and going down is a lookup
+        while done < iterations:
+            state = pipeline.grabcut_iterate(small_image, rect, state)
+            done += 1
+            self.cache.put(key + (done,), state)
+        return state
+
+
+class GrabCutPyramidSegmenter(Segmenter):
+    name = "GrabCut Pyramid"
+
+    def segment(self, image, params):
+        iterations = params["iterations"]
+        depth = pipeline.pyramid_depth(image.shape)
+        gray = self._cached(params, ("segmented_gray_pyramid", depth, iterations),
+                            lambda: pipeline.segment_grabcut_pyramid(image, iterations, depth))
+        return pipeline.threshold(gray, params["threshold"], self._buffer("binary", gray.shape))
+
+
+class OtsuSegmenter(Segmenter):
+    name = "Otsu Threshold"
+    realtime = True
+    halo = 2
+
+    def segment(self, image, params):
+        blurred = self._blurred(image, params)
+        histogram = params.get("statistics")
+        if histogram is None:
+            _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+                                      dst=self._buffer("binary", blurred.shape))
+            return self._objects_as_minority(binary)
+        value = otsu_threshold(histogram)
+        _, binary = cv2.threshold(blurred, value, 255, cv2.THRESH_BINARY, dst=self._buffer("binary", blurred.shape))
+        return self._objects_as_minority(binary, int(histogram[value + 1:].sum()), int(histogram.sum()))
+
+    def tile_statistics(self, image, params, core):
+        # the histogram of the blurred image decides both the threshold and which side is foreground
+        return np.bincount(self._blurred(image, params)[core].ravel(), minlength=256)
+
+    def _blurred(self, image, params):
+        gray = self._cached(params, ("gray",), lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        return cv2.GaussianBlur(gray, (5, 5), 0, dst=self._buffer("blurred", gray.shape))
+
+
+class AdaptiveThresholdSegmenter(Segmenter):
+    name = "Adaptive Threshold"
+    realtime = True
+    block_size = 51
+    offset = 5
+    # the 5x5 blur followed by the mean over the block
+    halo = block_size // 2 + 2
+
+    def segment(self, image, params):
+        binary = self._threshold(image, params)
+        statistics = params.get("statistics")
+        if statistics is None:
+            return self._objects_as_minority(binary)
+        total, foreground = statistics.tolist()
+        return self._objects_as_minority(binary, foreground, total)
+
+    def tile_statistics(self, image, params, core):
+        binary = self._threshold(image, params)[core]
+        return np.array([binary.size, cv2.countNonZero(binary)], dtype=np.int64)
+
+    def _threshold(self, image, params):
+        gray = self._cached(params, ("gray",), lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0, dst=self._buffer("blurred", gray.shape))
+        return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                     self.block_size, -self.offset, dst=self._buffer("binary", gray.shape))
+
+
+class CannySegmenter(Segmenter):
+    name = "Canny Edges"
+    realtime = True
+
+    def segment(self, image, params):
+        gray = self._cached(params, ("gray",), lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        edges = cv2.Canny(gray, params["canny_min"], params["canny_max"], edges=self._buffer("edges", gray.shape))
+        # close gaps in the outlines so every object becomes one filled region
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, dst=self._buffer("closed", gray.shape),
+                                  iterations=2)
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        binary = self._buffer("binary", gray.shape)
+        if binary is None:
+            binary = np.zeros_like(gray)
+        else:
+            binary.fill(0)
+        cv2.drawContours(binary, contours, -1, 255, thickness=cv2.FILLED)
+        return binary
+
+
+class WatershedSegmenter(Segmenter):
+    name = "Watershed"
+    # share of its own blob's distance-transform peak a pixel needs to seed an object
+    seed_ratio = 0.5
+
+    def segment(self, image, params):
+        binary = OtsuSegmenter(self.cache, self.buffers).segment(image, params)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, iterations=2)
+        sure_background = cv2.dilate(binary, kernel, iterations=3)
+        distance = cv2.distanceTransform(binary, cv2.DIST_L2, 5)
+        # seeds are taken relative to each blob's own peak, so small objects are not lost next to big ones
+        blob_count, blobs = cv2.connectedComponents(binary)
+        foreground = binary > 0
+        peaks = np.zeros(blob_count, dtype=np.float32)
+        np.maximum.at(peaks, blobs[foreground], distance[foreground])
+        sure_foreground = np.zeros_like(binary)
+        sure_foreground[foreground & (distance >= self.seed_ratio * peaks[blobs])] = 255
+        unknown = cv2.subtract(sure_background, sure_foreground)
+
+        _, markers = cv2.connectedComponents(sure_foreground)
+        markers += 1
+        markers[unknown == 255] = 0
+        markers = cv2.watershed(image, markers)
+        # watershed lines (-1) stay background, which splits touching objects
+        return np.where(markers > 1, 255, 0).astype(np.uint8)
+
+
+def otsu_threshold(histogram):
+    # cv2's THRESH_OTSU search run on a histogram, so tiles can share the threshold of the whole image
+    probabilities = histogram / histogram.sum()
+    mean = float((np.arange(256) * probabilities).sum())
+    q1 = mean1 = 0.0
+    best_sigma, best_value = 0.0, 0
+    epsilon = float(np.finfo(np.float32).eps)
+    for value, p in enumerate(probabilities.tolist()):
+        mean1 *= q1
+        q1 += p
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+        mean1 = (mean1 + value * p) / q1
+        mean2 = (mean - q1 * mean1) / q2
+        sigma = q1 * q2 * (mean1 - mean2) ** 2
+        if sigma > best_sigma:
+            best_sigma, best_value = sigma, value
+    return best_value
+
+
+SEGMENTERS = [
+    GrabCutSegmenter,
+    GrabCutPyramidSegmenter,
+    OtsuSegmenter,
+    AdaptiveThresholdSegmenter,
+    CannySegmenter,
+    WatershedSegmenter,
+]
+
+
+def create_segmenters(cache=None, buffers=None):
+    return {segmenter_class.name: segmenter_class(cache, buffers) for segmenter_class in SEGMENTERS}
@@ -0,0 +1,303 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import labeling
+from buffers import BufferPool
+from labeling import MIN_OBJECT_AREA
+from measurements import ObjectTable
+from segmenters import OtsuSegmenter, create_segmenters
+
+DEFAULT_METHOD = OtsuSegmenter.name
+DEFAULT_TILE_SIZE = 2048
+
+# one set of tile-sized buffers per worker process
+_worker_segmenters = create_segmenters(buffers=BufferPool())
+
+
+def _is_tiff(path):
+    return path.lower().endswith((".tif", ".tiff"))
+
+
+def open_source(path):
+    if path.lower().endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if _is_tiff(path):
+        try:
+            import tifffile
+            import zarr
+        except ImportError:
+            raise ImportError("Tiled TIFF input needs tifffile and zarr, or save the scan as .npy") from None
+        # only the TIFF tiles under a requested window get decoded
+        return zarr.open(tifffile.imread(path, aszarr=True), mode="r")
+    raise ValueError(f"Tiled input must be a .npy or .tif file: {path}")
+
+
+def tile_grid(shape, tile_size, margin):
+    # the cores cover the image without overlap, each one is read with `margin` pixels of context
+    h, w = shape[:2]
+    for row, y0 in enumerate(range(0, h, tile_size)):
+        for col, x0 in enumerate(range(0, w, tile_size)):
+            core = (y0, min(y0 + tile_size, h), x0, min(x0 + tile_size, w))
+            window = (max(core[0] - margin, 0), min(core[1] + margin, h),
+                      max(core[2] - margin, 0), min(core[3] + margin, w))
+            yield (row, col), core, window
+
+
+def read_window(path, window):
+    # the map is reopened for every tile: pages a process has touched count towards its resident
+    # memory until they are unmapped, so a long-lived map would grow to the size of the file
+    y0, y1, x0, x1 = window
+    tile = np.array(open_source(path)[y0:y1, x0:x1])
+    if tile.ndim == 2:
+        return cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+    if _is_tiff(path):
+        # tifffile gives RGB, the segmenters and the mean_b / mean_r columns expect cv2.imread's BGR
+        tile = cv2.cvtColor(tile, cv2.COLOR_RGB2BGR if tile.shape[2] == 3 else cv2.COLOR_RGBA2BGR)
+    return tile
+
+
+def _core_slice(core, window):
+    return slice(core[0] - window[0], core[1] - window[0]), slice(core[2] - window[2], core[3] - window[2])
+
+
+def tile_statistics(path, method, params, tile):
+    _, core, window = tile
+    return _worker_segmenters[method].tile_statistics(read_window(path, window), params, _core_slice(core, window))
+
+
+def label_tile(path, method, params, tile):
+    _, core, window = tile
+    image = read_window(path, window)
+    inner = _core_slice(core, window)
+    foreground = _worker_segmenters[method].segment(image, params) > 0
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(foreground[inner].view(np.uint8),
+                                                                       connectivity=8, ltype=cv2.CV_32S)
+    y0, _, x0, _ = core
+    areas = stats[1:, cv2.CC_STAT_AREA].astype(np.int64)
+    first_y, first_x = _first_pixels(labels, stats)
+
+    # a pixel is on the perimeter when a 4-neighbour is background or outside the image; the window
+    # reaches one pixel past every inner core edge, so this agrees with the whole-image labels
+    interior = np.zeros_like(foreground)
+    interior[1:-1, 1:-1] = (foreground[1:-1, 1:-1] & foreground[:-2, 1:-1] & foreground[2:, 1:-1]
+                            & foreground[1:-1, :-2] & foreground[1:-1, 2:])
+    boundary = (foreground & ~interior)[inner]
+
+    flat_labels = labels.ravel()
+    core_image = image[inner]
+    pieces = {
+        "area": areas,
+        "x0": stats[1:, cv2.CC_STAT_LEFT] + x0,
+        "y0": stats[1:, cv2.CC_STAT_TOP] + y0,
+        "x1": stats[1:, cv2.CC_STAT_LEFT] + stats[1:, cv2.CC_STAT_WIDTH] + x0,
+        "y1": stats[1:, cv2.CC_STAT_TOP] + stats[1:, cv2.CC_STAT_HEIGHT] + y0,
+        # integer coordinate sums, so a merged centroid is the same division cv2 does on the whole image
+        "sum_x": np.rint(centroids[1:, 0] * areas) + x0 * areas,
+        "sum_y": np.rint(centroids[1:, 1] * areas) + y0 * areas,
+        "first_y": first_y + y0,
+        "first_x": first_x + x0,
+        "perimeter": np.bincount(labels[boundary], minlength=count)[1:],
+    }
+    for channel, name in enumerate(("sum_b", "sum_g", "sum_r")):
+        pieces[name] = np.bincount(flat_labels, weights=core_image[:, :, channel].ravel(), minlength=count)[1:]
+    borders = (labels[0].copy(), labels[-1].copy(), labels[:, 0].copy(), labels[:, -1].copy())
+    return pieces, borders
+
+
+def _first_pixels(labels, stats):
+    # raster-order first pixel of every label: the leftmost one in its top row
+    tops = stats[:, cv2.CC_STAT_TOP]
+    rows, cols = np.nonzero((tops[labels] == np.arange(labels.shape[0])[:, None]) & (labels > 0))
+    found, first = np.unique(labels[rows, cols], return_index=True)
+    first_x = np.zeros(len(stats), dtype=np.int64)
+    first_x[found] = cols[first]
+    return tops[1:].astype(np.int64), first_x[1:]
+
+
+def _seam_pairs(a, a_base, b, b_base):
+    # pixel i of strip a touches pixels i-1..i+1 of strip b under 8-connectivity
+    pairs = []
+    for a_part, b_part in ((a, b), (a[1:], b[:-1]), (a[:-1], b[1:])):
+        touching = (a_part > 0) & (b_part > 0)
+        pairs.append(np.column_stack([a_part[touching] + a_base - 1, b_part[touching] + b_base - 1]))
+    return pairs
+
+
+def _union_find(count, pairs):
+    parent = np.arange(count)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs.tolist():
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def merge_tiles(results, image_width, min_area=MIN_OBJECT_AREA):
+    # results maps (row, col) to the pieces and border labels of that tile
+    bases, total = {}, 0
+    for key, (pieces, _) in results.items():
+        bases[key] = total
+        total += len(pieces["area"])
+
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for (row, col), (_, (top, bottom, left, right)) in results.items():
+        base = bases[(row, col)]
+        if (row, col + 1) in results:
+            neighbour = results[(row, col + 1)][1]
+            pairs += _seam_pairs(right, base, neighbour[2], bases[(row, col + 1)])
+        if (row + 1, col) in results:
+            neighbour = results[(row + 1, col)][1]
+            pairs += _seam_pairs(bottom, base, neighbour[0], bases[(row + 1, col)])
+        # tiles that only share a corner still join diagonally touching pixels
+        if (row + 1, col + 1) in results:
+            neighbour = results[(row + 1, col + 1)][1]
+            pairs += _seam_pairs(bottom[-1:], base, neighbour[0][:1], bases[(row + 1, col + 1)])
+        if (row + 1, col - 1) in results:
+            neighbour = results[(row + 1, col - 1)][1]
+            pairs += _seam_pairs(bottom[:1], base, neighbour[0][-1:], bases[(row + 1, col - 1)])
+    pairs = np.unique(np.concatenate(pairs).astype(np.int64), axis=0)
+    _, objects = np.unique(_union_find(total, pairs), return_inverse=True)
+    count = int(objects.max(initial=-1)) + 1
+
+    def gather(name):
+        return np.concatenate([pieces[name] for pieces, _ in results.values()])
+
+    def merged(values, reduce=None):
+        if reduce is None:
+            return np.bincount(objects, weights=values, minlength=count)
+        # every object has at least one piece, so the start value is always replaced
+        out = np.full(count, np.iinfo(np.int64).max if reduce is np.minimum else -1, dtype=np.int64)
+        reduce.at(out, objects, values)
+        return out
+
+    area = merged(gather("area")).astype(np.int64)
+    x0, y0 = merged(gather("x0"), np.minimum), merged(gather("y0"), np.minimum)
+    x1, y1 = merged(gather("x1"), np.maximum), merged(gather("y1"), np.maximum)
+    first = merged(gather("first_y") * image_width + gather("first_x"), np.minimum)
+
+    # objects are filtered by their merged area and numbered in raster order of their first pixel
+    kept = np.flatnonzero(area >= min_area)
+    kept = kept[np.argsort(first[kept], kind="stable")]
+    area = area[kept]
+    columns = {
+        "id": np.arange(1, len(kept) + 1, dtype=np.int32),
+        "area": area,
+        "x": x0[kept].astype(np.int32),
+        "y": y0[kept].astype(np.int32),
+        "width": (x1 - x0)[kept].astype(np.int32),
+        "height": (y1 - y0)[kept].astype(np.int32),
+        "cx": merged(gather("sum_x"))[kept] / area,
+        "cy": merged(gather("sum_y"))[kept] / area,
+        "perimeter": merged(gather("perimeter")).astype(np.int64)[kept],
+        "mean_b": merged(gather("sum_b"))[kept] / area,
+        "mean_g": merged(gather("sum_g"))[kept] / area,
+        "mean_r": merged(gather("sum_r"))[kept] / area,
+    }
+    return ObjectTable(columns)
+
+
+def count_objects_tiled(path, method=DEFAULT_METHOD, params=None, tile_size=DEFAULT_TILE_SIZE, workers=None,
+                        min_area=MIN_OBJECT_AREA):
+    segmenter = _worker_segmenters[method]
+    if segmenter.halo is None:
+        raise ValueError(f"{method} depends on the whole image and cannot run tiled")
+    shape = open_source(path).shape
+    params = {"threshold": 1, "iterations": 1, "canny_min": 100, "canny_max": 200, **(params or {})}
+    # one pixel past the segmenter's context, so seams and perimeters see the neighbouring tile
+    tiles = list(tile_grid(shape, tile_size, segmenter.halo + 1))
+    timings = {}
+
+    # workers get the path and a window, never pixels, so each process only ever holds one tile
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        statistics = None
+        for tile_result in executor.map(tile_statistics, *_arguments(path, method, params, tiles)):
+            if tile_result is not None:
+                statistics = tile_result if statistics is None else statistics + tile_result
+        if statistics is not None:
+            params["statistics"] = statistics
+        timings["statistics"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = dict(zip((key for key, _, _ in tiles),
+                           executor.map(label_tile, *_arguments(path, method, params, tiles))))
+        timings["labeling"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = merge_tiles(results, shape[1], min_area)
+    timings["merge"] = time.perf_counter() - start
+    return {"count": len(table), "table": table, "tiles": len(tiles), "timings": timings}
+
+
+def _arguments(path, method, params, tiles):
+    return [path] * len(tiles), [method] * len(tiles), [params] * len(tiles), tiles
+
+
+def count_objects_untiled(path, method=DEFAULT_METHOD, params=None, min_area=MIN_OBJECT_AREA):
+    # reference for --check, loads the whole image the way the GUI and batch counting do when it can
+    image = cv2.imread(path) if _is_tiff(path) else None
+    if image is None:
+        image = read_window(path, (0, None, 0, None))
+    params = {"threshold": 1, "iterations": 1, "canny_min": 100, "canny_max": 200, **(params or {})}
+    binary = create_segmenters()[method].segment(image, params)
+    return ObjectTable.from_components(labeling.label_objects(binary, min_area), image)
+
+
+def tables_match(a, b):
+    if len(a) != len(b):
+        return False
+    # compare object by object, whatever order the two labelings numbered them in
+    order_a = np.lexsort((a["x"], a["y"], a["cx"], a["cy"]))
+    order_b = np.lexsort((b["x"], b["y"], b["cx"], b["cy"]))
+    return all(np.allclose(a[name][order_a], b[name][order_b], rtol=0, atol=1e-9)
+               for name in a.columns if name != "id")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count objects in an image too large to load, tile by tile.")
+    parser.add_argument("image", help=".npy (memory-mapped) or tiled .tif scan")
+    parser.add_argument("--method", default=DEFAULT_METHOD, help="segmenter name, see segmenters.py")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE, help="tile side in pixels")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--threshold", type=int, default=1)
+    parser.add_argument("--table", help="optional per-object table, .csv, .npz or .parquet")
+    parser.add_argument("--check", action="store_true",
+                        help="also count the whole image at once and compare, needs it to fit in memory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {"threshold": args.threshold}
+    start = time.perf_counter()
+    result = count_objects_tiled(args.image, args.method, params, args.tile_size, args.workers)
+    elapsed = time.perf_counter() - start
+    timings = "  ".join(f"{stage}: {seconds:.2f}s" for stage, seconds in result["timings"].items())
+    print(f"Objects: {result['count']}  tiles: {result['tiles']}  total: {elapsed:.1f}s  ({timings})")
+    if args.table:
+        result["table"].save(args.table)
+    if args.check:
+        matches = tables_match(result["table"], count_objects_untiled(args.image, args.method, params))
+        print("Matches the untiled result" if matches else "Differs from the untiled result")
+        return 0 if matches else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
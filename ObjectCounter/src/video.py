@@ -0,0 +1,247 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import labeling
+from buffers import BufferPool
+from labeling import MIN_OBJECT_AREA
+from segmenters import OtsuSegmenter, create_segmenters
+
+DEFAULT_METHOD = OtsuSegmenter.name
+
+
+def box_iou(boxes_a, boxes_b):
+    # boxes are (x, y, w, h) rows, the result is a len(a) x len(b) matrix
+    ax0, ay0 = boxes_a[:, 0:1], boxes_a[:, 1:2]
+    ax1, ay1 = ax0 + boxes_a[:, 2:3], ay0 + boxes_a[:, 3:4]
+    bx0, by0 = boxes_b[:, 0], boxes_b[:, 1]
+    bx1, by1 = bx0 + boxes_b[:, 2], by0 + boxes_b[:, 3]
+    inter_w = np.clip(np.minimum(ax1, bx1) - np.maximum(ax0, bx0), 0, None)
+    inter_h = np.clip(np.minimum(ay1, by1) - np.maximum(ay0, by0), 0, None)
+    intersection = inter_w * inter_h
+    union = boxes_a[:, 2:3] * boxes_a[:, 3:4] + boxes_b[:, 2] * boxes_b[:, 3] - intersection
+    return intersection / np.maximum(union, 1)
+
+
+class CentroidTracker:
+    def __init__(self, iou_threshold=0.2, max_distance=80.0, max_missed=5, min_hits=3):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        # a track is only counted once it has been seen this many times, which filters flicker
+        self.min_hits = min_hits
+        self.next_id = 1
+        self.count = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.boxes = np.zeros((0, 4), dtype=np.float64)
+        self.centroids = np.zeros((0, 2), dtype=np.float64)
+        self.missed = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int64)
+
+    def update(self, boxes, centroids):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        track_for_detection = np.full(len(boxes), -1, dtype=np.int64)
+
+        if len(self.ids) and len(boxes):
+            iou = box_iou(self.boxes, boxes)
+            distance = np.linalg.norm(self.centroids[:, None, :] - centroids[None, :, :], axis=2)
+            # overlapping boxes win; small fast objects that no longer overlap fall back to centroid distance
+            score = np.where(iou >= self.iou_threshold, 1.0 + iou,
+                             np.where(distance <= self.max_distance, 1.0 - distance / self.max_distance, 0.0))
+            track_used = np.zeros(len(self.ids), dtype=bool)
+            for flat_index in np.argsort(score, axis=None)[::-1]:
+                track, detection = divmod(int(flat_index), len(boxes))
+                if score[track, detection] <= 0:
+                    break
+                if track_used[track] or track_for_detection[detection] >= 0:
+                    continue
+                track_used[track] = True
+                track_for_detection[detection] = track
+
+        matched = track_for_detection >= 0
+        matched_tracks = track_for_detection[matched]
+        self.boxes[matched_tracks] = boxes[matched]
+        self.centroids[matched_tracks] = centroids[matched]
+        self.hits[matched_tracks] += 1
+        self.missed += 1
+        self.missed[matched_tracks] = 0
+        self.count += int(np.count_nonzero(self.hits[matched_tracks] == self.min_hits))
+
+        new = ~matched
+        new_ids = np.arange(self.next_id, self.next_id + np.count_nonzero(new))
+        self.next_id += len(new_ids)
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.boxes = np.concatenate([self.boxes, boxes[new]])
+        self.centroids = np.concatenate([self.centroids, centroids[new]])
+        self.missed = np.concatenate([self.missed, np.zeros(len(new_ids), dtype=np.int64)])
+        self.hits = np.concatenate([self.hits, np.ones(len(new_ids), dtype=np.int64)])
+        self.count += len(new_ids) if self.min_hits <= 1 else 0
+
+        detection_ids = np.empty(len(boxes), dtype=np.int64)
+        detection_ids[matched] = self.ids[matched_tracks]
+        detection_ids[new] = new_ids
+
+        alive = self.missed <= self.max_missed
+        self.ids, self.boxes, self.centroids = self.ids[alive], self.boxes[alive], self.centroids[alive]
+        self.missed, self.hits = self.missed[alive], self.hits[alive]
+        return detection_ids
+
+
+class FrameReader(threading.Thread):
+    def __init__(self, path, queue_size=8, realtime=False):
+        super().__init__(daemon=True)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frames = queue.Queue(maxsize=queue_size)
+        # in real-time mode frames arrive at the clip's rate like from a camera and are dropped
+        # when processing falls behind, otherwise decoding waits for the consumer
+        self.realtime = realtime
+        self.frames_read = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                break
+            self.frames_read += 1
+            timestamp = self.frames_read / self.fps
+            if self.realtime:
+                delay = start + timestamp - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    self.frames.put_nowait((self.frames_read, timestamp, frame))
+                except queue.Full:
+                    # drop the oldest waiting frame so the consumer always gets the freshest ones
+                    try:
+                        self.frames.get_nowait()
+                    except queue.Empty:
+                        pass
+                    self.frames.put_nowait((self.frames_read, timestamp, frame))
+                    self.dropped += 1
+            else:
+                while not self.stopped.is_set():
+                    try:
+                        self.frames.put((self.frames_read, timestamp, frame), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        self.capture.release()
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+    def stop(self):
+        self.stopped.set()
+
+
+class VideoCounter:
+    def __init__(self, path, method=DEFAULT_METHOD, params=None, scale=0.5, realtime=False, queue_size=8,
+                 tracker=None):
+        self.reader = FrameReader(path, queue_size, realtime)
+        self.segmenter = create_segmenters(buffers=BufferPool())[method]
+        self.params = {"threshold": 1, "iterations": 1, "canny_min": 100, "canny_max": 200, **(params or {})}
+        self.scale = scale
+        self.tracker = tracker or CentroidTracker()
+        self.frames_processed = 0
+        self.elapsed = 0.0
+
+    def detect(self, frame):
+        small = frame if self.scale == 1 else cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale,
+                                                          interpolation=cv2.INTER_AREA)
+        binary = self.segmenter.segment(small, self.params)
+        components = labeling.label_objects(binary, min_area=MIN_OBJECT_AREA * self.scale ** 2)
+        return components.bboxes / self.scale, components.centroids / self.scale
+
+    def frames(self):
+        # yields (frame index, timestamp, frame, boxes, ids) until the clip ends or stop() is called
+        self.reader.start()
+        start = time.perf_counter()
+        try:
+            # stop() leaves the reader without an end marker to send, so the queue is polled
+            while not self.reader.stopped.is_set():
+                try:
+                    item = self.reader.frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                index, timestamp, frame = item
+                boxes, centroids = self.detect(frame)
+                ids = self.tracker.update(boxes, centroids)
+                self.frames_processed += 1
+                self.elapsed = time.perf_counter() - start
+                yield index, timestamp, frame, boxes, ids
+        finally:
+            self.reader.stop()
+
+    def stop(self):
+        self.reader.stop()
+
+    def stats(self):
+        return {
+            "frames_read": self.reader.frames_read,
+            "frames_processed": self.frames_processed,
+            "dropped_frames": self.reader.dropped,
+            "fps": self.frames_processed / self.elapsed if self.elapsed else 0.0,
+            "objects": self.tracker.count,
+        }
+
+
+def draw_tracks(frame, boxes, ids, size):
+    preview = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    scale = size[0] / frame.shape[1]
+    for (x, y, w, h), object_id in zip((boxes * scale).astype(np.int32).tolist(), ids.tolist()):
+        cv2.rectangle(preview, (x, y), (x + w, y + h), (0, 255, 0), 1)
+        cv2.putText(preview, str(object_id), (x, y - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    return preview
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count objects moving through a video, each one once.")
+    parser.add_argument("video")
+    parser.add_argument("--method", default=DEFAULT_METHOD, help="segmenter name, see segmenters.py")
+    parser.add_argument("--scale", type=float, default=0.5, help="segmentation scale")
+    parser.add_argument("--realtime", action="store_true",
+                        help="feed frames at the clip's frame rate and drop them when processing falls behind")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--output", help="optional JSONL file with the detections of every frame")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    counter = VideoCounter(args.video, args.method, scale=args.scale, realtime=args.realtime,
+                           queue_size=args.queue_size)
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for index, timestamp, _, boxes, ids in counter.frames():
+            if output:
+                output.write(json.dumps({"frame": index, "time": round(timestamp, 4), "ids": ids.tolist(),
+                                         "boxes": np.round(boxes, 1).tolist()}) + "\n")
+    finally:
+        if output:
+            output.close()
+    stats = counter.stats()
+    print(f"Objects: {stats['objects']}  frames: {stats['frames_processed']}/{stats['frames_read']}  "
+          f"dropped: {stats['dropped_frames']}  throughput: {stats['fps']:.1f} fps")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
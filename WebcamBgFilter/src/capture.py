@@ -0,0 +1,72 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class CaptureThread(threading.Thread):
+    # reads the camera as fast as it delivers into a small ring of preallocated frames, so nothing piles up in
+    # the driver; a consumer only ever gets the newest frame and every frame it never saw counts as dropped
+    def __init__(self, source=0, size=(640, 480), slots=3):
+        super().__init__(daemon=True)
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError("Cannot open webcam")
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.size = size
+        # one slot being written, one holding the newest frame, one lent out to the consumer
+        self.slots = [np.empty((size[1], size[0], 3), dtype=np.uint8) for _ in range(max(3, slots))]
+        self.timestamps = [0.0] * len(self.slots)
+        self.sequences = [0] * len(self.slots)
+        self.latest = None
+        self.lent = None
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.last_sequence = 0
+        self.failed_reads = 0
+
+    def run(self):
+        raw = None
+        while not self.stopped.is_set():
+            ok, raw = self.capture.read(raw)
+            # the timestamp is taken as soon as the driver hands the frame over
+            timestamp = time.perf_counter()
+            if not ok:
+                self.failed_reads += 1
+                time.sleep(0.01)
+                continue
+            with self.condition:
+                slot = next(i for i in range(len(self.slots)) if i != self.latest and i != self.lent)
+            if raw.shape[1] == self.size[0] and raw.shape[0] == self.size[1]:
+                self.slots[slot][:] = raw
+            else:
+                cv2.resize(raw, self.size, dst=self.slots[slot])
+            with self.condition:
+                self.frames_captured += 1
+                self.timestamps[slot] = timestamp
+                self.sequences[slot] = self.frames_captured
+                self.latest = slot
+                self.condition.notify_all()
+        self.capture.release()
+
+    def read(self, timeout=None):
+        # (sequence, timestamp, frame) of the newest frame the consumer has not seen yet, or None on timeout;
+        # the frame stays valid until the next read
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.latest is not None and
+                                           self.sequences[self.latest] > self.last_sequence, timeout):
+                return None
+            slot = self.latest
+            sequence = self.sequences[slot]
+            if self.last_sequence:
+                self.frames_dropped += sequence - self.last_sequence - 1
+            self.last_sequence = sequence
+            self.lent = slot
+            return sequence, self.timestamps[slot], self.slots[slot]
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,164 @@
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# frame time of a 30 fps camera, the budget a real-time filter has to fit in
+REALTIME_BUDGET_MS = 1000 / 30
+# weight of the newest call in a filter's running cost
+COST_SMOOTHING = 0.1
+
+
+class Filter:
+    name = None
+    # (key, label, minimum, maximum, default) of every slider the filter needs
+    parameters = ()
+
+    def __init__(self):
+        self.values = {key: default for key, _, _, _, default in self.parameters}
+        self.dst = None
+        self.cost_ms = None
+        self.prepare()
+
+    def set(self, key, value):
+        # kernels and tables are rebuilt here, once per change, never per frame
+        if self.values[key] != value:
+            self.values[key] = value
+            self.prepare()
+
+    def prepare(self):
+        pass
+
+    def apply(self, frame):
+        # the result goes to a buffer the filter keeps, valid until its next call
+        if self.dst is None or self.dst.shape != frame.shape:
+            self.dst = np.empty_like(frame)
+        start = time.perf_counter()
+        self.run(frame, self.dst)
+        cost = (time.perf_counter() - start) * 1000
+        self.cost_ms = cost if self.cost_ms is None else self.cost_ms + COST_SMOOTHING * (cost - self.cost_ms)
+        return self.dst
+
+    def run(self, frame, dst):
+        raise NotImplementedError
+
+
+class PointFilter(Filter):
+    # a per-pixel mapping of 8-bit values, looked up in a 256-entry table
+    def prepare(self):
+        self.table = self.build_table(np.arange(256, dtype=np.float32)).clip(0, 255).round().astype(np.uint8)
+
+    def build_table(self, values):
+        raise NotImplementedError
+
+    def run(self, frame, dst):
+        cv2.LUT(frame, self.table, dst=dst)
+
+
+class GaussianBlurFilter(Filter):
+    name = "Gaussian Blur"
+    parameters = (("sigma", "Sigma X (Gaussian Blur):", 1, 100, 25),)
+    ksize = 21
+
+    def prepare(self):
+        self.kernel = cv2.getGaussianKernel(self.ksize, self.values["sigma"])
+
+    def run(self, frame, dst):
+        # the separable kernel built once beats GaussianBlur working it out on every call
+        cv2.sepFilter2D(frame, -1, self.kernel, self.kernel, dst=dst)
+
+
+class BilateralFilter(Filter):
+    name = "Bilateral Filter"
+    parameters = (
+        ("diameter", "Diameter (Bilateral Filter):", 1, 25, 15),
+        ("sigma_color", "Sigma Color (Bilateral Filter):", 1, 200, 75),
+        ("sigma_space", "Sigma Space (Bilateral Filter):", 1, 200, 75),
+    )
+
+    def run(self, frame, dst):
+        cv2.bilateralFilter(frame, self.values["diameter"], self.values["sigma_color"], self.values["sigma_space"],
+                            dst=dst)
+
+
+class BoxFilter(Filter):
+    name = "Box Filter"
+    parameters = (("size", "Kernel Size (Box Filter):", 1, 100, 25),)
+
+    def run(self, frame, dst):
+        size = self.values["size"]
+        cv2.boxFilter(frame, -1, (size, size), dst=dst)
+
+
+class SepiaFilter(Filter):
+    name = "Sepia Effect"
+    parameters = (("intensity", "Intensity (Sepia):", 0, 100, 100),)
+    # the usual sepia weights for RGB, rows and columns reversed for BGR frames
+    sepia = np.array([[0.393, 0.769, 0.189],
+                      [0.349, 0.686, 0.168],
+                      [0.272, 0.534, 0.131]], dtype=np.float32)[::-1, ::-1]
+
+    def prepare(self):
+        # blended towards the identity below full intensity
+        amount = self.values["intensity"] / 100
+        self.matrix = np.ascontiguousarray(amount * self.sepia + (1 - amount) * np.eye(3, dtype=np.float32))
+
+    def run(self, frame, dst):
+        # one pass over the 8-bit frame with saturation, no float copy of it
+        cv2.transform(frame, self.matrix, dst=dst)
+
+
+class InvertFilter(PointFilter):
+    name = "Invert Colors"
+
+    def build_table(self, values):
+        return 255 - values
+
+
+FILTERS = [
+    GaussianBlurFilter,
+    BilateralFilter,
+    BoxFilter,
+    SepiaFilter,
+    InvertFilter,
+]
+
+
+def create_filters():
+    return {filter_class.name: filter_class() for filter_class in FILTERS}
+
+
+def measure_filters(frame, repeat=20):
+    # best time in ms of every filter with its default parameters
+    costs = {}
+    for name, image_filter in create_filters().items():
+        image_filter.apply(frame)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            image_filter.apply(frame)
+            times.append(time.perf_counter() - start)
+        costs[name] = min(times) * 1000
+    return costs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost of every background filter on a synthetic frame.")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None, help="OpenCV threads, 1 for a single core")
+    args = parser.parse_args(argv)
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    frame = np.random.default_rng(0).integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    for name, cost in measure_filters(frame, args.repeat).items():
+        verdict = "real-time" if cost <= REALTIME_BUDGET_MS else "too slow"
+        print(f"{name:<18} {cost:>8.2f} ms  {verdict}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
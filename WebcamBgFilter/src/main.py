@@ -1,8 +1,30 @@
 import sys
-import cv2
+import time
 import numpy as np
 from PyQt6 import QtCore, QtGui, QtWidgets
 
+from capture import CaptureThread
+from filters import create_filters
+from segmentation import BackgroundSubtractorSegmenter, create_segmenters
+
+FRAME_SIZE = (640, 480)
+# the processing loop polls for a new frame this often, so it waits at most this long once it is idle
+POLL_INTERVAL_MS = 2
+# how often the fps / latency / dropped frame line is refreshed
+STATS_INTERVAL_S = 1.0
+# the learning rate slider moves in steps of this
+LEARNING_RATE_STEP = 0.0001
+# fractions of the frame size the subject mask can be computed at
+MASK_SCALES = {"Mask at full size": 1.0, "Mask at 1/2 size": 0.5, "Mask at 1/4 size": 0.25}
+
+SLIDER_STYLE = (
+    "QSlider::groove:horizontal { border: 1px solid #bbb; background: #ddd; height: 6px; border-radius: 3px; }"
+    "QSlider::handle:horizontal { background: #3498db; border: 1px solid #2980b9; width: 14px; height: 14px; border-radius: 7px; margin: -5px 0; }"
+    "QSlider::handle:horizontal:hover { background: #2980b9; }"
+    "QSlider::sub-page:horizontal { background: #3498db; border: 1px solid #2980b9; height: 6px; border-radius: 3px; }"
+    "QSlider::add-page:horizontal { background: #ccc; border: 1px solid #aaa; height: 6px; border-radius: 3px; }"
+)
+
 
 class VideoFilterApp(QtWidgets.QWidget):
     def __init__(self):
@@ -15,63 +37,34 @@ class VideoFilterApp(QtWidgets.QWidget):
         self.image_label = QtWidgets.QLabel(self)
         layout.addWidget(self.image_label)
 
+        self.stats_label = QtWidgets.QLabel(self)
+        layout.addWidget(self.stats_label)
+
+        # background filters, each with a panel of the sliders it declares
+        self.filters = create_filters()
         self.filter_combo = QtWidgets.QComboBox(self)
-        self.filter_combo.addItems([  # filters
-            "Gaussian Blur",
-            "Bilateral Filter",
-            "Box Filter",
-            "Sepia Effect",
-            "Invert Colors"
-        ])
-        self.filter_combo.currentIndexChanged.connect(self.filter_changed)
+        self.filter_combo.addItems(list(self.filters))
+        self.filter_combo.currentTextChanged.connect(self.filter_changed)
         layout.addWidget(self.filter_combo)
 
-        # gaussian blur slider
-        self.gaussianSigmaXLabel = QtWidgets.QLabel("Sigma X (Gaussian Blur):", self)
-        self.gaussianSigmaXSlider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, self)
-        self.gaussianSigmaXSlider.setRange(1, 100)
-        self.gaussianSigmaXSlider.setValue(25)
-        self.gaussianSigmaXSlider.setTickInterval(5)
-        self.gaussianSigmaXSlider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
-        self.gaussianSigmaXSlider.valueChanged.connect(self.update_filter_parameter)
-        self.gaussianSigmaXSlider.setStyleSheet(
-            "QSlider::groove:horizontal { border: 1px solid #bbb; background: #ddd; height: 6px; border-radius: 3px; }"
-            "QSlider::handle:horizontal { background: #3498db; border: 1px solid #2980b9; width: 14px; height: 14px; border-radius: 7px; margin: -5px 0; }"
-            "QSlider::handle:horizontal:hover { background: #2980b9; }"
-            "QSlider::sub-page:horizontal { background: #3498db; border: 1px solid #2980b9; height: 6px; border-radius: 3px; }"
-            "QSlider::add-page:horizontal { background: #ccc; border: 1px solid #aaa; height: 6px; border-radius: 3px; }"
-        )
-
-        # bilateral filter sliders
-        self.bilateralSigmaColorLabel = QtWidgets.QLabel("Sigma Color (Bilateral Filter):", self)
-        self.bilateralSigmaColorSlider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, self)
-        self.bilateralSigmaColorSlider.setRange(1, 200)
-        self.bilateralSigmaColorSlider.setValue(75)
-        self.bilateralSigmaColorSlider.setTickInterval(5)
-        self.bilateralSigmaColorSlider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
-        self.bilateralSigmaColorSlider.valueChanged.connect(self.update_filter_parameter)
-        self.bilateralSigmaColorSlider.setStyleSheet(
-            "QSlider::groove:horizontal { border: 1px solid #bbb; background: #ddd; height: 6px; border-radius: 3px; }"
-            "QSlider::handle:horizontal { background: #3498db; border: 1px solid #2980b9; width: 14px; height: 14px; border-radius: 7px; margin: -5px 0; }"
-            "QSlider::handle:horizontal:hover { background: #2980b9; }"
-            "QSlider::sub-page:horizontal { background: #3498db; border: 1px solid #2980b9; height: 6px; border-radius: 3px; }"
-            "QSlider::add-page:horizontal { background: #ccc; border: 1px solid #aaa; height: 6px; border-radius: 3px; }"
-        )
-
-        self.bilateralSigmaSpaceLabel = QtWidgets.QLabel("Sigma Space (Bilateral Filter):", self)
-        self.bilateralSigmaSpaceSlider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, self)
-        self.bilateralSigmaSpaceSlider.setRange(1, 200)
-        self.bilateralSigmaSpaceSlider.setValue(75)
-        self.bilateralSigmaSpaceSlider.setTickInterval(5)
-        self.bilateralSigmaSpaceSlider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
-        self.bilateralSigmaSpaceSlider.valueChanged.connect(self.update_filter_parameter)
-        self.bilateralSigmaSpaceSlider.setStyleSheet(
-            "QSlider::groove:horizontal { border: 1px solid #bbb; background: #ddd; height: 6px; border-radius: 3px; }"
-            "QSlider::handle:horizontal { background: #3498db; border: 1px solid #2980b9; width: 14px; height: 14px; border-radius: 7px; margin: -5px 0; }"
-            "QSlider::handle:horizontal:hover { background: #2980b9; }"
-            "QSlider::sub-page:horizontal { background: #3498db; border: 1px solid #2980b9; height: 6px; border-radius: 3px; }"
-            "QSlider::add-page:horizontal { background: #ccc; border: 1px solid #aaa; height: 6px; border-radius: 3px; }"
-        )
+        self.filter_panels = {}
+        for name, image_filter in self.filters.items():
+            panel = QtWidgets.QWidget(self)
+            panel_layout = QtWidgets.QVBoxLayout(panel)
+            panel_layout.setContentsMargins(0, 0, 0, 0)
+            for key, label, minimum, maximum, default in image_filter.parameters:
+                slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, panel)
+                slider.setRange(minimum, maximum)
+                slider.setValue(default)
+                slider.setTickInterval(5)
+                slider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
+                slider.valueChanged.connect(lambda value, f=image_filter, k=key: f.set(k, value))
+                slider.setStyleSheet(SLIDER_STYLE)
+                panel_layout.addWidget(QtWidgets.QLabel(label, panel))
+                panel_layout.addWidget(slider)
+            panel.setVisible(False)
+            layout.addWidget(panel)
+            self.filter_panels[name] = panel
 
         # threshold adjusting slider
         self.thresholdLabel = QtWidgets.QLabel("Threshold Value:", self)
@@ -81,164 +74,151 @@ class VideoFilterApp(QtWidgets.QWidget):
         self.thresholdSlider.setTickInterval(5)
         self.thresholdSlider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
         self.thresholdSlider.valueChanged.connect(self.update_threshold_value)
-        self.thresholdSlider.setStyleSheet(
-            "QSlider::groove:horizontal { border: 1px solid #bbb; background: #ddd; height: 6px; border-radius: 3px; }"
-            "QSlider::handle:horizontal { background: #3498db; border: 1px solid #2980b9; width: 14px; height: 14px; border-radius: 7px; margin: -5px 0; }"
-            "QSlider::handle:horizontal:hover { background: #2980b9; }"
-            "QSlider::sub-page:horizontal { background: #3498db; border: 1px solid #2980b9; height: 6px; border-radius: 3px; }"
-            "QSlider::add-page:horizontal { background: #ccc; border: 1px solid #aaa; height: 6px; border-radius: 3px; }"
-        )
-
-        self.bilateralSigmaColorLabel.setVisible(False)
-        self.bilateralSigmaColorSlider.setVisible(False)
-        self.bilateralSigmaSpaceLabel.setVisible(False)
-        self.bilateralSigmaSpaceSlider.setVisible(False)
-
-        layout.addWidget(self.gaussianSigmaXLabel)
-        layout.addWidget(self.gaussianSigmaXSlider)
-        layout.addWidget(self.bilateralSigmaColorLabel)
-        layout.addWidget(self.bilateralSigmaColorSlider)
-        layout.addWidget(self.bilateralSigmaSpaceLabel)
-        layout.addWidget(self.bilateralSigmaSpaceSlider)
+        self.thresholdSlider.setStyleSheet(SLIDER_STYLE)
 
         layout.addWidget(self.thresholdLabel)
         layout.addWidget(self.thresholdSlider)
 
-        self.setLayout(layout)
+        # segmentation engine, grabcut or a background subtractor
+        self.segmenters = create_segmenters()
+        self.segmenter_combo = QtWidgets.QComboBox(self)
+        self.segmenter_combo.addItems(list(self.segmenters))
+        self.segmenter_combo.currentTextChanged.connect(self.segmenter_changed)
+        layout.addWidget(self.segmenter_combo)
+
+        # a smaller mask is upsampled along the frame's edges
+        self.mask_scale_combo = QtWidgets.QComboBox(self)
+        self.mask_scale_combo.addItems(list(MASK_SCALES))
+        self.mask_scale_combo.currentTextChanged.connect(self.mask_scale_changed)
+        layout.addWidget(self.mask_scale_combo)
+
+        # temporal grabcut carries the mask and colour models over from the previous frame
+        self.temporalCheckBox = QtWidgets.QCheckBox("Temporal segmentation", self)
+        self.temporalCheckBox.setChecked(True)
+        self.temporalCheckBox.toggled.connect(self.update_temporal)
+        layout.addWidget(self.temporalCheckBox)
+
+        # how fast a background subtractor absorbs changes, and a switch that stops it learning
+        self.learningRateLabel = QtWidgets.QLabel(self)
+        self.learningRateSlider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, self)
+        self.learningRateSlider.setRange(1, 100)
+        self.learningRateSlider.setValue(10)
+        self.learningRateSlider.valueChanged.connect(self.update_learning_rate)
+        self.learningRateSlider.setStyleSheet(SLIDER_STYLE)
+        self.freezeButton = QtWidgets.QPushButton("Freeze Background", self)
+        self.freezeButton.setCheckable(True)
+        self.freezeButton.toggled.connect(self.update_freeze)
+        layout.addWidget(self.learningRateLabel)
+        layout.addWidget(self.learningRateSlider)
+        layout.addWidget(self.freezeButton)
 
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
-            raise IOError("Cannot open webcam")
+        self.setLayout(layout)
 
-        self.backSub = cv2.createBackgroundSubtractorMOG2()
+        # the camera is read on its own thread, update_frame only ever picks up the newest frame
+        self.capture = CaptureThread(0, FRAME_SIZE)
+        self.capture.start()
+        self.frames_shown = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.stats_start = time.perf_counter()
 
-        self.selected_filter = "Gaussian Blur"
-        self.sigmaX = 25
-        self.sigmaColor = 75
-        self.sigmaSpace = 75
+        self.image_filter = None
+        self.filter_changed(self.filter_combo.currentText())
         self.threshold_value = 180
+        self.segmenter = self.segmenters[self.segmenter_combo.currentText()]
+        self.segmenter.threshold_value = self.threshold_value
+        self.update_learning_rate(self.learningRateSlider.value())
+        self.segmenter_changed(self.segmenter.name)
 
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_frame)
-        self.timer.start(60)
-
-    def filter_changed(self):
-        self.selected_filter = self.filter_combo.currentText()
-        if self.selected_filter == "Gaussian Blur":
-            self.gaussianSigmaXLabel.setText("Sigma X (Gaussian Blur):")
-            self.bilateralSigmaColorLabel.setVisible(False)
-            self.bilateralSigmaColorSlider.setVisible(False)
-            self.bilateralSigmaSpaceLabel.setVisible(False)
-            self.bilateralSigmaSpaceSlider.setVisible(False)
-            self.gaussianSigmaXSlider.setVisible(True)
-            self.thresholdSlider.setVisible(True)
-            self.thresholdLabel.setVisible(True)
-            self.gaussianSigmaXLabel.setVisible(True)
-        elif self.selected_filter == "Bilateral Filter":
-            self.gaussianSigmaXLabel.setText("Diameter (Bilateral Filter):")
-            self.bilateralSigmaColorLabel.setVisible(True)
-            self.bilateralSigmaColorSlider.setVisible(True)
-            self.bilateralSigmaSpaceLabel.setVisible(True)
-            self.bilateralSigmaSpaceSlider.setVisible(True)
-            self.gaussianSigmaXSlider.setVisible(True)
-            self.thresholdSlider.setVisible(True)
-            self.thresholdLabel.setVisible(True)
-            self.gaussianSigmaXLabel.setVisible(True)
-        elif self.selected_filter == "Box Filter":
-            self.gaussianSigmaXLabel.setText("Kernel Size (Box Filter):")
-            self.bilateralSigmaColorLabel.setVisible(False)
-            self.bilateralSigmaColorSlider.setVisible(False)
-            self.bilateralSigmaSpaceLabel.setVisible(False)
-            self.bilateralSigmaSpaceSlider.setVisible(False)
-            self.gaussianSigmaXSlider.setVisible(True)
-            self.thresholdSlider.setVisible(True)
-            self.thresholdLabel.setVisible(True)
-            self.gaussianSigmaXLabel.setVisible(True)
-        elif self.selected_filter == "Sepia Effect":
-            self.gaussianSigmaXLabel.setText("Intensity (Sepia):")
-            self.bilateralSigmaColorLabel.setVisible(False)
-            self.bilateralSigmaColorSlider.setVisible(False)
-            self.bilateralSigmaSpaceLabel.setVisible(False)
-            self.bilateralSigmaSpaceSlider.setVisible(False)
-            self.gaussianSigmaXSlider.setVisible(True)
-            self.thresholdSlider.setVisible(True)
-            self.thresholdLabel.setVisible(True)
-            self.gaussianSigmaXLabel.setVisible(True)
-        elif self.selected_filter == "Invert Colors":
-            self.gaussianSigmaXLabel.setVisible(False)
-            self.gaussianSigmaXSlider.setVisible(False)
-            self.thresholdSlider.setVisible(False)
-            self.thresholdLabel.setVisible(False)
-            self.bilateralSigmaColorLabel.setVisible(False)
-            self.bilateralSigmaColorSlider.setVisible(False)
-            self.bilateralSigmaSpaceLabel.setVisible(False)
-            self.bilateralSigmaSpaceSlider.setVisible(False)
-
-    def update_filter_parameter(self):
-        self.sigmaX = self.gaussianSigmaXSlider.value()
-        self.sigmaColor = self.bilateralSigmaColorSlider.value()
-        self.sigmaSpace = self.bilateralSigmaSpaceSlider.value()
+        self.timer.start(POLL_INTERVAL_MS)
+
+    def filter_changed(self, name):
+        self.image_filter = self.filters[name]
+        for panel_name, panel in self.filter_panels.items():
+            panel.setVisible(panel_name == name)
 
     def update_threshold_value(self):
         self.threshold_value = self.thresholdSlider.value()
+        self.segmenter.threshold_value = self.threshold_value
+
+    def segmenter_changed(self, name):
+        self.segmenter = self.segmenters[name]
+        self.segmenter.threshold_value = self.threshold_value
+        self.segmenter.reset()
+        subtractor = isinstance(self.segmenter, BackgroundSubtractorSegmenter)
+        self.temporalCheckBox.setVisible(not subtractor)
+        self.learningRateLabel.setVisible(subtractor)
+        self.learningRateSlider.setVisible(subtractor)
+        self.freezeButton.setVisible(subtractor)
+
+    def mask_scale_changed(self, text):
+        for segmenter in self.segmenters.values():
+            segmenter.scale = MASK_SCALES[text]
+            segmenter.reset()
+
+    def update_temporal(self, checked):
+        self.segmenters["GrabCut"].temporal = checked
+        self.segmenters["GrabCut"].reset()
+
+    def update_learning_rate(self, value):
+        learning_rate = value * LEARNING_RATE_STEP
+        self.learningRateLabel.setText(f"Learning rate: {learning_rate:g}")
+        for segmenter in self.segmenters.values():
+            if isinstance(segmenter, BackgroundSubtractorSegmenter):
+                segmenter.learning_rate = learning_rate
+
+    def update_freeze(self, checked):
+        for segmenter in self.segmenters.values():
+            if isinstance(segmenter, BackgroundSubtractorSegmenter):
+                segmenter.frozen = checked
 
     def update_frame(self):
         try:
-            ret, frame = self.cap.read()
-            if not ret:
-                print("Failed to capture frame")
+            item = self.capture.read(timeout=0)
+            if item is None:
                 return
+            _, timestamp, frame = item
 
-            frame = cv2.resize(frame, (640, 480))
-            original_frame = frame.copy()
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, self.threshold_value, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            if contours:
-                largest_contour = max(contours, key=cv2.contourArea)
-                mask = np.zeros(frame.shape[:2], dtype=np.uint8)
-                cv2.drawContours(mask, [largest_contour], -1, 1, thickness=-1)
-
-                bgdModel = np.zeros((1, 65), dtype=np.float64)
-                fgdModel = np.zeros((1, 65), dtype=np.float64)
-
-                cv2.grabCut(frame, mask, None, bgdModel, fgdModel, iterCount=5, mode=cv2.GC_INIT_WITH_MASK)
-
-                subject_mask = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
-
-                filtered_background = original_frame.copy()
-                if self.selected_filter == "Gaussian Blur":
-                    filtered_background = cv2.GaussianBlur(filtered_background, (21, 21), self.sigmaX)
-                elif self.selected_filter == "Bilateral Filter":
-                    filtered_background = cv2.bilateralFilter(filtered_background, 15, self.sigmaColor, self.sigmaSpace)
-                elif self.selected_filter == "Box Filter":
-                    filtered_background = cv2.boxFilter(filtered_background, -1, (self.sigmaX, self.sigmaX))
-                elif self.selected_filter == "Sepia Effect":
-                    filtered_background = self.apply_sepia(filtered_background)
-                elif self.selected_filter == "Invert Colors":
-                    filtered_background = cv2.bitwise_not(filtered_background)
+            subject_mask = self.segmenter.segment(frame)
 
-                result_frame = filtered_background.copy()
-                result_frame[subject_mask == 1] = original_frame[subject_mask == 1]
+            # the filter writes into its own buffer and the subject is copied back over it; no mask is an
+            # empty scene for a background subtractor, the whole frame is filtered then
+            result_frame = self.image_filter.apply(frame)
+            if subject_mask is not None:
+                np.copyto(result_frame, frame, where=subject_mask.view(bool)[:, :, None])
 
-                qimg = QtGui.QImage(result_frame.data, result_frame.shape[1], result_frame.shape[0],
-                                    result_frame.strides[0], QtGui.QImage.Format.Format_BGR888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                self.image_label.setPixmap(pixmap)
+            qimg = QtGui.QImage(result_frame.data, result_frame.shape[1], result_frame.shape[0],
+                                result_frame.strides[0], QtGui.QImage.Format.Format_BGR888)
+            pixmap = QtGui.QPixmap.fromImage(qimg)
+            self.image_label.setPixmap(pixmap)
+            self.update_stats(timestamp)
 
         except Exception as e:
             print(f"Error in update_frame: {e}")
 
-    def apply_sepia(self, frame):
-        frame = frame.astype(np.float32)
-        sepia_filter = np.array([[0.393, 0.769, 0.189],
-                                 [0.349, 0.686, 0.168],
-                                 [0.272, 0.534, 0.131]])
-        frame = np.dot(frame, sepia_filter.T)
-        frame = np.clip(frame, 0, 255).astype(np.uint8)
-        return frame
+    def update_stats(self, timestamp):
+        # latency runs from the driver handing the frame over to its result being on the label
+        latency = time.perf_counter() - timestamp
+        self.frames_shown += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        elapsed = time.perf_counter() - self.stats_start
+        if elapsed >= STATS_INTERVAL_S:
+            self.stats_label.setText(
+                f"{self.frames_shown / elapsed:.1f} fps  latency {self.latency_total / self.frames_shown * 1000:.0f} ms "
+                f"(max {self.latency_max * 1000:.0f} ms)  captured {self.capture.frames_captured}  "
+                f"dropped {self.capture.frames_dropped}  {self.segmenter.status()}  "
+                f"{self.image_filter.name} {self.image_filter.cost_ms:.1f} ms")
+            self.frames_shown = 0
+            self.latency_total = self.latency_max = 0.0
+            self.stats_start = time.perf_counter()
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.capture.stop()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
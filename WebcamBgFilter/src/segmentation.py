@@ -0,0 +1,223 @@
+import cv2
+import numpy as np
+
+# mean gray-level change between thumbnails of consecutive frames that counts as a new scene
+SCENE_CHANGE_THRESHOLD = 25.0
+THUMBNAIL_SIZE = (80, 60)
+# learning rate of a frozen background model; KNN reads exactly 0 as "update every frame"
+FROZEN_LEARNING_RATE = 1e-6
+# window radius, in mask pixels, and regularisation of the guided filter that brings a small mask back to
+# full size; a smaller eps lets the mask follow weaker edges of the frame
+GUIDE_RADIUS = 2
+GUIDE_EPS = 1e-3
+
+
+def largest_contour_mask(frame, threshold_value):
+    # 1 inside the largest Otsu contour, 0 elsewhere, None when nothing was found
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, threshold_value, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest_contour = max(contours, key=cv2.contourArea)
+    mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+    cv2.drawContours(mask, [largest_contour], -1, 1, thickness=-1)
+    return mask
+
+
+def guided_upsample(mask, guide, radius=GUIDE_RADIUS, eps=GUIDE_EPS):
+    # fast guided filter: the local linear model mask ~ a * gray + b is fitted at the mask's size against a
+    # shrunk copy of the guide, then a and b are enlarged and applied to the full-size gray frame, so the
+    # outline snaps to edges the small mask could not resolve
+    h, w = mask.shape
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    small = cv2.resize(guide, (w, h), interpolation=cv2.INTER_AREA).astype(np.float32)
+    small *= 1 / 255.0
+    p = mask.astype(np.float32)
+    mean_i = cv2.boxFilter(small, -1, ksize)
+    mean_p = cv2.boxFilter(p, -1, ksize)
+    covariance = cv2.boxFilter(small * p, -1, ksize) - mean_i * mean_p
+    variance = cv2.boxFilter(small * small, -1, ksize) - mean_i * mean_i
+    a = covariance / (variance + eps)
+    b = mean_p - a * mean_i
+    size = (guide.shape[1], guide.shape[0])
+    a = cv2.resize(cv2.boxFilter(a, -1, ksize), size, interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.boxFilter(b, -1, ksize), size, interpolation=cv2.INTER_LINEAR)
+    # a * gray / 255 + b above one half
+    q = cv2.multiply(guide, a, scale=1 / 255.0, dtype=cv2.CV_32F)
+    q += b
+    return (q > 0.5).view(np.uint8)
+
+
+class Segmenter:
+    # segment(frame) gives the subject mask (1 subject, 0 background) or None when there is no subject.
+    # Below a scale of 1 the engine sees a shrunk frame and its mask is brought back to full size by
+    # guided_upsample, so the engine's cost falls with the square of the scale
+    name = None
+    scale = 1.0
+
+    def reset(self):
+        pass
+
+    def segment(self, frame):
+        if self.scale >= 1:
+            return self.segment_frame(frame)
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, round(w * self.scale)), max(1, round(h * self.scale))),
+                           interpolation=cv2.INTER_AREA)
+        mask = self.segment_frame(small)
+        if mask is None:
+            return None
+        return guided_upsample(mask, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+    def segment_frame(self, frame):
+        raise NotImplementedError
+
+    def status(self):
+        # a few words for the status line
+        return ""
+
+
+class GrabCutSegmenter(Segmenter):
+    # in temporal mode the GMMs and the last mask carry over: each frame is seeded from the previous mask
+    # (eroded as sure foreground, dilated as probable) and refined by one GC_EVAL iteration; the
+    # per-frame Otsu seeding and full iterations only run on the first frame and after a scene change
+    name = "GrabCut"
+
+    def __init__(self, temporal=True, iterations=5, erode=5, dilate=10, scene_change=SCENE_CHANGE_THRESHOLD):
+        self.temporal = temporal
+        self.iterations = iterations
+        self.erode_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * erode + 1, 2 * erode + 1))
+        self.dilate_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilate + 1, 2 * dilate + 1))
+        self.scene_change = scene_change
+        self.threshold_value = 180
+        self.reinitialisations = 0
+        self.reset()
+
+    def reset(self):
+        self.bgd_model = np.zeros((1, 65), dtype=np.float64)
+        self.fgd_model = np.zeros((1, 65), dtype=np.float64)
+        self.subject = None
+        self.thumbnail = None
+        self.labels = None
+
+    def segment_frame(self, frame):
+        thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), THUMBNAIL_SIZE,
+                               interpolation=cv2.INTER_AREA)
+        scene_changed = (self.thumbnail is None or
+                         cv2.norm(thumbnail, self.thumbnail, cv2.NORM_L1) / thumbnail.size > self.scene_change)
+        self.thumbnail = thumbnail
+        if not self.temporal or scene_changed or self.subject is None or self.subject.shape != frame.shape[:2]:
+            return self._initialise(frame)
+
+        # grabCut needs samples of both sides, a mask that lost one of them starts over
+        subject_pixels = cv2.countNonZero(self.subject)
+        if not subject_pixels or subject_pixels == self.subject.size:
+            return self._initialise(frame)
+        labels = self._seed_labels()
+        cv2.grabCut(frame, labels, None, self.bgd_model, self.fgd_model, iterCount=1, mode=cv2.GC_EVAL)
+        return self._subject_from(labels)
+
+    def status(self):
+        return f"reinit {self.reinitialisations}"
+
+    def _initialise(self, frame):
+        self.reinitialisations += 1
+        self.bgd_model[:] = 0
+        self.fgd_model[:] = 0
+        labels = largest_contour_mask(frame, self.threshold_value)
+        # grabCut cannot learn from a seed without both sides either
+        if labels is None or not 0 < cv2.countNonZero(labels) < labels.size:
+            self.subject = None
+            return None
+        cv2.grabCut(frame, labels, None, self.bgd_model, self.fgd_model, iterCount=self.iterations,
+                    mode=cv2.GC_INIT_WITH_MASK)
+        return self._subject_from(labels)
+
+    def _seed_labels(self):
+        # sure background, a probable band on either side of the last outline and a sure core
+        if self.labels is None or self.labels.shape != self.subject.shape:
+            self.labels = np.empty_like(self.subject)
+            self.band = np.empty_like(self.subject)
+        labels, band = self.labels, self.band
+        labels.fill(cv2.GC_BGD)
+        cv2.dilate(self.subject, self.dilate_kernel, dst=band)
+        labels[band > 0] = cv2.GC_PR_BGD
+        labels[self.subject > 0] = cv2.GC_PR_FGD
+        cv2.erode(self.subject, self.erode_kernel, dst=band)
+        labels[band > 0] = cv2.GC_FGD
+        return labels
+
+    def _subject_from(self, labels):
+        self.subject = np.where((labels == cv2.GC_BGD) | (labels == cv2.GC_PR_BGD), 0, 1).astype(np.uint8)
+        return self.subject
+
+
+class BackgroundSubtractorSegmenter(Segmenter):
+    # the subject is whatever differs from a learned model of the empty scene: the subtractor's mask without
+    # shadows, cleaned up by opening and closing, reduced to its largest connected component
+    subtractor_factory = None
+    learning_rate = 0.001
+
+    def __init__(self, min_area=500, warmup_frames=30):
+        self.min_area = min_area
+        self.warmup_frames = warmup_frames
+        self.frozen = False
+        self.threshold_value = 180
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        self.reset()
+
+    def reset(self):
+        self.subtractor = self.subtractor_factory()
+        self.subject = None
+        self.frames_seen = 0
+
+    def segment_frame(self, frame):
+        # the first frames are learned at the subtractor's own fast start-up rate; after that a frozen model
+        # keeps the scene it has, so a subject standing still does not fade into it
+        self.frames_seen += 1
+        if self.frames_seen <= self.warmup_frames:
+            learning_rate = -1
+        else:
+            learning_rate = FROZEN_LEARNING_RATE if self.frozen else self.learning_rate
+        foreground = self.subtractor.apply(frame, learningRate=learning_rate)
+        # shadows are marked 127
+        cv2.threshold(foreground, 200, 255, cv2.THRESH_BINARY, dst=foreground)
+        cv2.morphologyEx(foreground, cv2.MORPH_OPEN, self.kernel, dst=foreground)
+        cv2.morphologyEx(foreground, cv2.MORPH_CLOSE, self.kernel, dst=foreground, iterations=2)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=8)
+        if count < 2:
+            return None
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        if stats[largest, cv2.CC_STAT_AREA] < self.min_area:
+            return None
+        if self.subject is None or self.subject.shape != labels.shape:
+            self.subject = np.empty(labels.shape, dtype=np.uint8)
+        np.equal(labels, largest, out=self.subject, casting="unsafe")
+        return self.subject
+
+    def status(self):
+        if self.frames_seen <= self.warmup_frames:
+            return "learning the background"
+        return "frozen" if self.frozen else f"learning {self.learning_rate:g}"
+
+
+class MOG2Segmenter(BackgroundSubtractorSegmenter):
+    name = "MOG2"
+    subtractor_factory = staticmethod(lambda: cv2.createBackgroundSubtractorMOG2(detectShadows=True))
+
+
+class KNNSegmenter(BackgroundSubtractorSegmenter):
+    name = "KNN"
+    subtractor_factory = staticmethod(lambda: cv2.createBackgroundSubtractorKNN(detectShadows=True))
+
+
+SEGMENTERS = [
+    GrabCutSegmenter,
+    MOG2Segmenter,
+    KNNSegmenter,
+]
+
+
+def create_segmenters():
+    return {segmenter_class.name: segmenter_class() for segmenter_class in SEGMENTERS}